@@ -1,16 +1,29 @@
-from .uploadData import process_images_from_uploadgate, insert_image
-from .deleteData import delete_image, delete_images_by_project
-from .updateData import update_image_labels, update_image_project
-from .drive_utils import upload_image_to_drive
+import importlib
 
 __version__ = "0.1.0"
 
-__all__ = [
-    "process_images_from_uploadgate",
-    "insert_image",
-    "delete_image",
-    "delete_images_by_project",
-    "update_image_labels",
-    "update_image_project",
-    "upload_image_to_drive",
-] 
\ No newline at end of file
+# Public names and the module providing each. Modules are imported on first
+# attribute access, so importing the package does no I/O and stays fast.
+_EXPORTS = {
+    "process_images_from_uploadgate": "uploadData",
+    "insert_image": "uploadData",
+    "delete_image": "deleteData",
+    "delete_project": "deleteData",
+    "update_image": "updateData",
+    "update_project": "updateData",
+    "upload_image_to_drive": "drive_utils",
+    "metrics": "metrics",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
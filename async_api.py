@@ -0,0 +1,308 @@
+import asyncio
+import json
+import mimetypes
+import os
+import aiohttp
+from google.auth.transport.requests import Request
+from firebase_admin import firestore, firestore_async
+from clients import get_firebase_app, get_drive_credentials
+from metrics import metrics
+from rate_limiter import drive_scheduler, firestore_scheduler, IDEMPOTENT_METHODS, IDEMPOTENT_OPERATIONS
+from drive_utils import (
+    check_folder_exists, ensure_folder_shared, convert_datetime,
+    SHARING_PER_FILE, SHARING_INHERIT, UPLOAD_CHUNK_SIZE
+)
+
+DRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3"
+
+# Bytes read from the response per step while streaming a download to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Simultaneous connections to Google APIs per session
+DEFAULT_CONNECTION_LIMIT = 100
+
+class AsyncDriveClient:
+    """
+    Minimal Drive v3 client on aiohttp for use inside an event loop
+
+    Requests share one connection pool, so thousands of transfers can be in flight
+    without a thread per request. Every request runs through
+    drive_scheduler.acall, sharing the Drive quota and retry rules of the
+    synchronous API. Files are read and written in the default
+    executor, one chunk at a time, so the event loop never blocks on disk and no
+    file is held in memory whole. The service account token is refreshed in the
+    default executor when it expires.
+
+    Args:
+        credentials: Google service account credentials for Drive; defaults to the
+            shared credentials from clients.get_drive_credentials
+        connection_limit (int): Maximum simultaneous connections
+    """
+
+    def __init__(self, credentials=None, connection_limit=DEFAULT_CONNECTION_LIMIT):
+        self.credentials = credentials or get_drive_credentials()
+        self.connection_limit = connection_limit
+        self._session = None
+        self._token_lock = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._token_lock = asyncio.Lock()
+        return self._session
+
+    async def _headers(self):
+        async with self._token_lock:
+            if not self.credentials.valid:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.credentials.refresh, Request())
+        return {'Authorization': f"Bearer {self.credentials.token}"}
+
+    async def request(self, method, url, operation='drive.request', **kwargs):
+        """Send an authorised request and return the decoded JSON response."""
+        session = await self._get_session()
+        extra_headers = kwargs.pop('headers', {})
+
+        async def send():
+            headers = await self._headers()
+            headers.update(extra_headers)
+            async with session.request(method, url, headers=headers, **kwargs) as response:
+                response.raise_for_status()
+                if response.status == 204:
+                    return None
+                return await response.json()
+
+        return await drive_scheduler.acall(
+            send, operation=operation,
+            idempotent=method in IDEMPOTENT_METHODS or operation in IDEMPOTENT_OPERATIONS)
+
+    async def download(self, file_id, save_path):
+        """Stream a Drive file to save_path without buffering it in memory."""
+        session = await self._get_session()
+        loop = asyncio.get_running_loop()
+        part_path = f"{save_path}.part"
+
+        async def fetch():
+            # A retry starts the file over, so only the last attempt's bytes are kept
+            headers = await self._headers()
+            received = 0
+            async with session.get(f"{DRIVE_API_URL}/files/{file_id}", params={'alt': 'media'}, headers=headers) as response:
+                response.raise_for_status()
+                f = await loop.run_in_executor(None, open, part_path, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await loop.run_in_executor(None, f.write, chunk)
+                        received += len(chunk)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+            return received
+
+        received = await drive_scheduler.acall(fetch, operation='drive.files.get_media')
+        metrics.add_bytes('drive.files.get_media', received=received)
+        await loop.run_in_executor(None, os.replace, part_path, save_path)
+
+    async def upload(self, image_path, metadata, mimetype, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Upload a file as a resumable upload and return its 'id' and 'webViewLink'
+
+        The file is sent in chunks of chunk_size bytes, each read from disk in the
+        default executor just before it is sent.
+        """
+        session = await self._get_session()
+        loop = asyncio.get_running_loop()
+        size = await loop.run_in_executor(None, os.path.getsize, image_path)
+
+        async def open_session():
+            headers = await self._headers()
+            headers.update({'X-Upload-Content-Type': mimetype, 'X-Upload-Content-Length': str(size)})
+            async with session.post(
+                    f"{DRIVE_UPLOAD_URL}/files", headers=headers, json=metadata,
+                    params={'uploadType': 'resumable', 'fields': 'id, webViewLink'}) as response:
+                response.raise_for_status()
+                return response.headers['Location']
+
+        async def send_chunk(session_uri, offset, chunk):
+            headers = await self._headers()
+            if chunk:
+                headers['Content-Range'] = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+            else:
+                headers['Content-Range'] = f"bytes */{size}"
+            async with session.put(session_uri, headers=headers, data=chunk, allow_redirects=False) as response:
+                if response.status != 308:
+                    response.raise_for_status()
+                    return await response.json(content_type=None), size
+                # 308 Resume Incomplete: carry on after the last byte Drive has
+                committed = response.headers.get('Range')
+                return None, int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+
+        # Opening a session, or repeating a chunk, cannot create a second file, so
+        # both are retried on transient errors like the synchronous uploader
+        session_uri = await drive_scheduler.acall(open_session, operation='drive.files.create')
+
+        def read_chunk(f, offset):
+            f.seek(offset)
+            return f.read(chunk_size)
+
+        f = await loop.run_in_executor(None, open, image_path, 'rb')
+        try:
+            offset = 0
+            while True:
+                chunk = await loop.run_in_executor(None, read_chunk, f, offset)
+                file, next_offset = await drive_scheduler.acall(
+                    send_chunk, session_uri, offset, chunk, operation='drive.files.create')
+                metrics.add_bytes('drive.files.create', sent=max(0, next_offset - offset))
+                if file is not None:
+                    return file
+                offset = next_offset
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    async def share_publicly(self, file_id):
+        await self.request(
+            'POST', f"{DRIVE_API_URL}/files/{file_id}/permissions", operation='drive.permissions.create',
+            params={'fields': 'id'},
+            json={'type': 'anyone', 'role': 'reader'}
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+_default_client = None
+
+def get_async_drive_client():
+    """Return the module's shared AsyncDriveClient."""
+    global _default_client
+    if _default_client is None:
+        _default_client = AsyncDriveClient()
+    return _default_client
+
+def _file_id_from_url(image_url):
+    # Extract file ID from Google Drive URL if full URL is provided
+    if 'drive.google.com' in image_url:
+        return image_url.split('/d/')[1].split('/')[0]
+    return image_url
+
+async def async_download_image(image_url, save_path, client=None):
+    """Async counterpart of downloadData.download_image."""
+    client = client or get_async_drive_client()
+    try:
+        await client.download(_file_id_from_url(image_url), save_path)
+        return True
+    except Exception as e:
+        print(f"Error downloading image from Google Drive: {e}")
+        return False
+
+async def async_upload_image_to_drive(image_path, destination_name, sharing=SHARING_PER_FILE, client=None):
+    """Async counterpart of drive_utils.upload_image_to_drive."""
+    client = client or get_async_drive_client()
+    try:
+        # The folder lookup is cached, so only the first call reaches Drive
+        loop = asyncio.get_running_loop()
+        images_folder_id = await loop.run_in_executor(None, check_folder_exists, "images")
+        if sharing == SHARING_INHERIT:
+            await loop.run_in_executor(None, ensure_folder_shared, images_folder_id)
+
+        mimetype = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+        file = await client.upload(image_path, {'name': destination_name, 'parents': [images_folder_id]}, mimetype)
+        if sharing != SHARING_INHERIT:
+            await client.share_publicly(file['id'])
+
+        return {
+            'file_id': file['id'],
+            'url': file['webViewLink']
+        }
+    except Exception as e:
+        print(f"Error uploading image to Drive: {e}")
+        return None
+
+async def async_get_image(image_id, db=None):
+    """Async counterpart of drive_utils.get_image using the async Firestore client."""
+    db = db or firestore_async.client(get_firebase_app())
+    try:
+        doc = await firestore_scheduler.acall(
+            db.collection('images').document(str(image_id)).get, operation='firestore.document.get')
+        if doc.exists:
+            return doc.to_dict()
+        print(f"Image with ID {image_id} not found")
+        return None
+    except Exception as e:
+        print(f"Error retrieving image document: {e}")
+        return None
+
+async def async_list_images(project_name=None, limit=10, db=None):
+    """Async counterpart of drive_utils.list_images using the async Firestore client."""
+    db = db or firestore_async.client(get_firebase_app())
+    try:
+        query = db.collection('images')
+        if project_name:
+            query = query.where('project', '==', project_name)
+        query = query.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
+        return [doc.to_dict() async for doc in firestore_scheduler.astream(query.stream, operation='firestore.query.stream')]
+    except Exception as e:
+        print(f"Error listing images: {e}")
+        return []
+
+async def async_download_image_and_metadata(image_id, output_dir, image_data=None, db=None, client=None):
+    """Async counterpart of downloadData.download_image_and_metadata."""
+    os.makedirs(output_dir, exist_ok=True)
+    if image_data is None:
+        image_data = await async_get_image(image_id, db)
+        if image_data is None:
+            return False
+
+    image_url = image_data.get('drive_file_id') or image_data.get('image')
+    if not image_url:
+        print(f"No image URL found for image {image_id}")
+        return False
+
+    image_path = os.path.join(output_dir, f"{image_id}_{image_data.get('original_name', 'image.jpg')}")
+    if not await async_download_image(image_url, image_path, client):
+        return False
+
+    def save_metadata():
+        with open(os.path.join(output_dir, f"{image_id}_metadata.json"), 'w') as f:
+            json.dump(image_data, f, indent=2, default=convert_datetime)
+
+    await asyncio.get_running_loop().run_in_executor(None, save_metadata)
+    return True
+
+async def async_download_project_images(project_name, output_dir, concurrency=64, limit=None, db=None, client=None):
+    """
+    Download every image of a project with up to `concurrency` transfers in flight
+
+    Returns:
+        list: IDs of the images that failed to download
+    """
+    db = db or firestore_async.client(get_firebase_app())
+    project_dir = os.path.join(output_dir, project_name)
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def download(doc):
+        try:
+            if not await async_download_image_and_metadata(doc.id, project_dir, doc.to_dict(), client=client):
+                failed.append(doc.id)
+        except Exception as e:
+            # One image must not abort the whole run through gather
+            print(f"Error downloading image {doc.id}: {e}")
+            failed.append(doc.id)
+        finally:
+            semaphore.release()
+
+    query = db.collection('images').where('project', '==', project_name).order_by('id', direction=firestore.Query.ASCENDING)
+    if limit is not None:
+        query = query.limit(limit)
+
+    tasks = set()
+    async for doc in firestore_scheduler.astream(query.stream, operation='firestore.query.stream'):
+        # Stop reading the stream while all slots are busy so memory stays bounded
+        await semaphore.acquire()
+        task = asyncio.create_task(download(doc))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    return failed
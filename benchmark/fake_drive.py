@@ -0,0 +1,476 @@
+import email.parser
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Error returned when an error is injected, by HTTP status
+INJECTED_ERRORS = {
+    403: ('rateLimitExceeded', 'Rate Limit Exceeded'),
+    429: ('rateLimitExceeded', 'Rate Limit Exceeded'),
+    500: ('backendError', 'Backend Error'),
+    503: ('backendError', 'Service Unavailable'),
+}
+
+_CLAUSE_PATTERNS = [
+    (re.compile(r"^name\s*=\s*'((?:[^'\\]|\\.)*)'$"), 'name'),
+    (re.compile(r"^mimeType\s*=\s*'([^']*)'$"), 'mimeType'),
+    (re.compile(r"^mimeType\s*!=\s*'([^']*)'$"), 'notMimeType'),
+    (re.compile(r"^'([^']*)'\s+in\s+parents$"), 'parent'),
+    (re.compile(r"^trashed\s*=\s*(true|false)$"), 'trashed'),
+]
+
+def _parse_query(q):
+    """Turn the subset of the Drive query language used by this package into filters."""
+    filters = []
+    for clause in re.split(r"\s+and\s+", q.strip()) if q else []:
+        for pattern, kind in _CLAUSE_PATTERNS:
+            match = pattern.match(clause.strip())
+            if match:
+                value = match.group(1).replace("\\'", "'").replace("\\\\", "\\")
+                filters.append((kind, value))
+                break
+        else:
+            raise ValueError(f"Unsupported query clause: {clause}")
+    return filters
+
+def _matches(file, filters):
+    for kind, value in filters:
+        if kind == 'name' and file['name'] != value:
+            return False
+        if kind == 'mimeType' and file['mimeType'] != value:
+            return False
+        if kind == 'notMimeType' and file['mimeType'] == value:
+            return False
+        if kind == 'parent' and value not in file['parents']:
+            return False
+        if kind == 'trashed' and value == 'true':
+            return False
+    return True
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class FakeDriveServer:
+    """
+    In-memory stand-in for the parts of the Drive v3 API this package uses
+
+    Supports files create (metadata, resumable and multipart uploads), get,
+    get_media (with Range), list, delete, permissions create, about get and batch
+    requests. Every request can be delayed by latency +/- jitter seconds, and a
+    fraction error_rate of requests fails with one of error_statuses, so retry and
+    rate limiting behaviour can be measured. Calls and their latencies are counted
+    per operation.
+
+    Point the package at it with DRIVE_API_ROOT=server.url.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on; 0 picks a free port
+        latency (float): Seconds added to every request
+        jitter (float): Largest random deviation from latency in seconds
+        error_rate (float): Fraction of requests answered with an injected error
+        error_statuses (tuple): HTTP statuses used for injected errors
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_statuses=(429, 503)):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.files = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.reset_stats()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Statistics
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = defaultdict(int)
+            self.errors = defaultdict(int)
+            self.latencies = defaultdict(list)
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def stats(self):
+        """Return call counts, injected errors, bytes and p50/p99 latency per operation."""
+        with self._lock:
+            all_latencies = [value for values in self.latencies.values() for value in values]
+            return {
+                'calls': dict(self.calls),
+                'total_calls': sum(self.calls.values()),
+                'injected_errors': dict(self.errors),
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+                'latency_ms': {
+                    operation: {
+                        'p50': round(_percentile(values, 0.50) * 1000, 2),
+                        'p99': round(_percentile(values, 0.99) * 1000, 2),
+                    }
+                    for operation, values in self.latencies.items()
+                },
+                'p50_ms': round((_percentile(all_latencies, 0.50) or 0) * 1000, 2),
+                'p99_ms': round((_percentile(all_latencies, 0.99) or 0) * 1000, 2),
+            }
+
+    # Store
+
+    def _new_id(self):
+        with self._lock:
+            self._counter += 1
+            return f"fake{self._counter:012d}"
+
+    def create_file(self, name, mime_type='application/octet-stream', parents=None, content=b''):
+        """Add a file (or, with FOLDER_MIME_TYPE, a folder) directly to the store."""
+        file_id = self._new_id()
+        file = {
+            'id': file_id,
+            'name': name,
+            'mimeType': mime_type,
+            'parents': list(parents or ['root']),
+            'webViewLink': f"https://drive.google.com/file/d/{file_id}/view?usp=drivesdk",
+            'content': content,
+        }
+        if mime_type != FOLDER_MIME_TYPE:
+            file['size'] = str(len(content))
+            file['md5Checksum'] = hashlib.md5(content).hexdigest()
+        with self._lock:
+            self.files[file_id] = file
+        return file
+
+    def create_folder(self, name, parents=None):
+        return self.create_file(name, FOLDER_MIME_TYPE, parents)
+
+    @staticmethod
+    def _resource(file):
+        return {key: value for key, value in file.items() if key != 'content'}
+
+    def _delete(self, file_id):
+        # Deleting a folder deletes everything inside it, as in Drive
+        with self._lock:
+            file = self.files.pop(file_id, None)
+            if file is None:
+                return False
+            if file['mimeType'] != FOLDER_MIME_TYPE:
+                return True
+            children = [child_id for child_id, child in self.files.items() if file_id in child['parents']]
+        for child_id in children:
+            self._delete(child_id)
+        return True
+
+    # Request handling
+
+    def _maybe_fail(self, operation):
+        if self.error_rate and random.random() < self.error_rate:
+            status = random.choice(self.error_statuses)
+            reason, message = INJECTED_ERRORS.get(status, ('backendError', 'Injected error'))
+            with self._lock:
+                self.errors[operation] += 1
+            return self._error(status, message, reason)
+        return None
+
+    @staticmethod
+    def _json(status, body, headers=None):
+        return status, dict({'Content-Type': 'application/json; charset=UTF-8'}, **(headers or {})), \
+            json.dumps(body).encode('utf-8')
+
+    @classmethod
+    def _error(cls, status, message, reason='notFound'):
+        return cls._json(status, {'error': {
+            'code': status, 'message': message,
+            'errors': [{'domain': 'usageLimits' if 'Limit' in reason else 'global', 'reason': reason, 'message': message}]
+        }})
+
+    def _operation(self, method, path, params):
+        if path.endswith('/batch/drive/v3') or path.endswith('/batch'):
+            return 'batch'
+        if '/upload/' in path:
+            if 'upload_id' in params:
+                return 'files.upload_chunk'
+            return 'files.create'
+        if path.endswith('/about'):
+            return 'about.get'
+        if path.endswith('/permissions'):
+            return 'permissions.create'
+        if path.endswith('/files'):
+            return 'files.create' if method == 'POST' else 'files.list'
+        if method == 'DELETE':
+            return 'files.delete'
+        if params.get('alt') == ['media']:
+            return 'files.get_media'
+        return 'files.get'
+
+    def handle(self, method, target, headers, body, base_url, top_level=True):
+        """
+        Answer one Drive request
+
+        Args:
+            method (str): HTTP method
+            target (str): Path and query string
+            headers (dict): Request headers with lower-case names
+            body (bytes): Request body
+            base_url (str): Scheme and host used in upload session URLs
+            top_level (bool): False for requests inside a batch, which are not delayed
+
+        Returns:
+            tuple: (status, response headers, response body)
+        """
+        started = time.perf_counter()
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        operation = self._operation(method, url.path, params)
+
+        if top_level and (self.latency or self.jitter):
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        response = self._maybe_fail(operation)
+        if response is None:
+            try:
+                response = self._dispatch(operation, method, url.path, params, headers, body, base_url)
+            except Exception as e:
+                response = self._error(400, str(e), 'badRequest')
+
+        with self._lock:
+            self.calls[operation] += 1
+            self.latencies[operation].append(time.perf_counter() - started)
+            self.bytes_received += len(body)
+            self.bytes_sent += len(response[2])
+        return response
+
+    def _dispatch(self, operation, method, path, params, headers, body, base_url):
+        if operation == 'batch':
+            return self._batch(headers, body, base_url)
+        if operation == 'about.get':
+            with self._lock:
+                used = sum(len(file['content']) for file in self.files.values())
+            return self._json(200, {
+                'user': {'displayName': 'Fake Drive', 'emailAddress': 'fake@example.com'},
+                'storageQuota': {'limit': str(15 * 1024 ** 3), 'usage': str(used), 'usageInDrive': str(used)},
+            })
+        if operation == 'files.upload_chunk':
+            return self._upload_chunk(params['upload_id'][0], headers, body)
+        if operation == 'files.create':
+            return self._create(path, params, headers, body, base_url)
+        if operation == 'files.list':
+            return self._list(params)
+
+        match = re.search(r'/files/([^/]+)(/permissions)?$', path)
+        if not match:
+            return self._error(404, f"Unknown path {path}")
+        file_id = match.group(1)
+        with self._lock:
+            file = self.files.get(file_id)
+        if operation == 'files.delete':
+            if not self._delete(file_id):
+                return self._error(404, f"File not found: {file_id}.")
+            return 204, {}, b''
+        if file is None:
+            return self._error(404, f"File not found: {file_id}.")
+        if operation == 'permissions.create':
+            return self._json(200, {'kind': 'drive#permission', 'id': 'anyoneWithLink', 'type': 'anyone', 'role': 'reader'})
+        if operation == 'files.get_media':
+            return self._media(file, headers)
+        return self._json(200, self._resource(file))
+
+    def _create(self, path, params, headers, body, base_url):
+        upload_type = params.get('uploadType', [None])[0]
+        if upload_type == 'resumable':
+            metadata = json.loads(body or b'{}')
+            upload_id = uuid.uuid4().hex
+            total = headers.get('x-upload-content-length')
+            with self._lock:
+                self._uploads[upload_id] = {
+                    'metadata': metadata,
+                    'mime_type': headers.get('x-upload-content-type', 'application/octet-stream'),
+                    'data': bytearray(),
+                    'total': int(total) if total else None,
+                }
+            location = f"{base_url}{path.lstrip('/')}?uploadType=resumable&upload_id={upload_id}"
+            return 200, {'Location': location}, b''
+        if upload_type == 'multipart':
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + headers['content-type'].encode() + b"\r\n\r\n" + body)
+            metadata_part, media_part = message.get_payload()
+            metadata = json.loads(metadata_part.get_payload(decode=True) or b'{}')
+            content = media_part.get_payload(decode=True)
+            mime_type = media_part.get_content_type()
+        elif upload_type == 'media':
+            metadata, content, mime_type = {}, body, headers.get('content-type', 'application/octet-stream')
+        else:
+            metadata, content, mime_type = json.loads(body or b'{}'), b'', None
+        file = self.create_file(
+            metadata.get('name', 'Untitled'),
+            metadata.get('mimeType') or mime_type or 'application/octet-stream',
+            metadata.get('parents'),
+            content
+        )
+        return self._json(200, self._resource(file))
+
+    def _upload_chunk(self, upload_id, headers, body):
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+        if upload is None:
+            return self._error(404, "Upload session not found")
+        match = re.match(r'bytes (\*|(\d+)-(\d+))/(\*|\d+)', headers.get('content-range', ''))
+        if not match:
+            return self._error(400, "Missing Content-Range", 'badRequest')
+        total = None if match.group(4) == '*' else int(match.group(4))
+        with self._lock:
+            if match.group(1) != '*':
+                start = int(match.group(2))
+                if start != len(upload['data']):
+                    # Drive keeps what it has; the client re-sends from the reported range
+                    return 308, self._range_header(upload), b''
+                upload['data'].extend(body)
+            if total is not None:
+                upload['total'] = total
+            complete = upload['total'] is not None and len(upload['data']) >= upload['total']
+            if complete:
+                del self._uploads[upload_id]
+        if not complete:
+            return 308, self._range_header(upload), b''
+        metadata = upload['metadata']
+        file = self.create_file(
+            metadata.get('name', 'Untitled'),
+            metadata.get('mimeType') or upload['mime_type'],
+            metadata.get('parents'),
+            bytes(upload['data'])
+        )
+        return self._json(200, self._resource(file))
+
+    @staticmethod
+    def _range_header(upload):
+        received = len(upload['data'])
+        return {'Range': f"bytes=0-{received - 1}"} if received else {}
+
+    def _list(self, params):
+        filters = _parse_query(params.get('q', [''])[0])
+        page_size = min(int(params.get('pageSize', ['100'])[0]), 1000)
+        offset = int(params.get('pageToken', ['0'])[0])
+        with self._lock:
+            matching = [self._resource(file) for file in self.files.values() if _matches(file, filters)]
+        page = matching[offset:offset + page_size]
+        result = {'kind': 'drive#fileList', 'files': page}
+        if offset + page_size < len(matching):
+            result['nextPageToken'] = str(offset + page_size)
+        return self._json(200, result)
+
+    def _media(self, file, headers):
+        content = file['content']
+        match = re.match(r'bytes=(\d+)-(\d*)', headers.get('range', ''))
+        if not match:
+            return 200, {'Content-Type': file['mimeType']}, content
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(content) - 1, len(content) - 1)
+        return 206, {
+            'Content-Type': file['mimeType'],
+            'Content-Range': f"bytes {start}-{end}/{len(content)}",
+        }, content[start:end + 1]
+
+    def _batch(self, headers, body, base_url):
+        message = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + headers['content-type'].encode() + b"\r\n\r\n" + body)
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload(decode=True)
+            head, _, sub_body = request.partition(b"\r\n\r\n")
+            lines = head.decode('utf-8').split("\r\n")
+            sub_method, sub_target, _ = lines[0].split(" ", 2)
+            sub_headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                sub_headers[name.strip().lower()] = value.strip()
+            status, response_headers, response_body = self.handle(
+                sub_method, sub_target, sub_headers, sub_body, base_url, top_level=False)
+            response_headers = dict(response_headers, **{'Content-Length': str(len(response_body))})
+            response = f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n" + "".join(
+                f"{name}: {value}\r\n" for name, value in response_headers.items()) + "\r\n"
+            content_id = part['Content-ID'].strip('<>')
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                .encode() + response.encode() + response_body + b"\r\n"
+            )
+        payload = b"".join(parts) + f"--{boundary}--\r\n".encode()
+        return 200, {'Content-Type': f"multipart/mixed; boundary={boundary}"}, payload
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as httplib2 reuses its connections
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                headers = {name.lower(): value for name, value in self.headers.items()}
+                base_url = f"http://{self.headers.get('Host', server.url.split('//')[1].rstrip('/'))}/"
+                status, response_headers, response_body = server.handle(
+                    self.command, self.path, headers, body, base_url)
+                self.send_response(status)
+                for name, value in response_headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(response_body)))
+                self.end_headers()
+                self.wfile.write(response_body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Drive v3 API")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail")
+    args = parser.parse_args()
+
+    server = FakeDriveServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    server.create_folder('images')
+    print(f"Fake Drive listening on {server.url}; export DRIVE_API_ROOT={server.url}")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
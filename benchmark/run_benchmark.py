@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "driveController"))
+from fake_drive import FakeDriveServer
+
+SCENARIOS = ('upload', 'list_tree', 'download', 'update', 'delete')
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+def _write_upload_gate(upload_gate_dir, count, file_size):
+    """Fill an uploadGate directory with count distinct JPEG-named files of file_size bytes."""
+    images_dir = os.path.join(upload_gate_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    block = os.urandom(max(0, file_size - 12))
+    for index in range(count):
+        with open(os.path.join(images_dir, f"img_{index:06d}.jpg"), 'wb') as f:
+            # The index makes every file's content, and so its checksum, unique
+            f.write(b"\xff\xd8\xff\xe0" + index.to_bytes(8, 'big') + block)
+
+def _scheduler_counts():
+    from rate_limiter import drive_scheduler, firestore_scheduler
+    return {
+        'drive_retries': drive_scheduler.retries,
+        'drive_throttled': drive_scheduler.throttled,
+        'firestore_calls': firestore_scheduler.calls,
+        'firestore_retries': firestore_scheduler.retries,
+    }
+
+def run_scenario(name, count, server, func):
+    """
+    Time one scenario and collect its Drive and Firestore call statistics
+
+    Args:
+        name (str): Scenario name
+        count (int): Images the scenario handles, used for ops/sec
+        server (FakeDriveServer): Drive stand-in whose counters are reset first
+        func (callable): Runs the scenario and returns a truthy value on success
+
+    Returns:
+        dict: Scenario result
+    """
+    server.reset_stats()
+    before = _scheduler_counts()
+    started = time.perf_counter()
+    ok = func()
+    elapsed = time.perf_counter() - started
+    after = _scheduler_counts()
+    stats = server.stats()
+    result = {
+        'scenario': name,
+        'images': count,
+        'ok': bool(ok),
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(count / elapsed, 1) if elapsed else None,
+        'drive_calls': stats['total_calls'],
+        'drive_calls_by_operation': stats['calls'],
+        'drive_p50_ms': stats['p50_ms'],
+        'drive_p99_ms': stats['p99_ms'],
+        'drive_latency_ms_by_operation': stats['latency_ms'],
+        'drive_injected_errors': sum(stats['injected_errors'].values()),
+        'drive_bytes_received': stats['bytes_received'],
+        'drive_bytes_sent': stats['bytes_sent'],
+    }
+    result.update({key: after[key] - before[key] for key in after})
+    print(f"{name:<10} {count:>7} images  {result['seconds']:>9.2f}s  {result['ops_per_sec'] or 0:>9.1f} ops/s  "
+          f"{result['drive_calls']:>7} Drive calls  p50 {result['drive_p50_ms']:>7.1f}ms  "
+          f"p99 {result['drive_p99_ms']:>7.1f}ms  {result['drive_retries']:>5} retries  "
+          f"{result['firestore_calls']:>7} Firestore calls  {'ok' if ok else 'FAILED'}")
+    return result
+
+def benchmark_size(count, server, args):
+    """Run the selected scenarios against a fresh project of count images."""
+    from clients import get_firestore_client
+    from uploadData import process_images_from_uploadgate
+    from downloadData import download_project_images
+    from updateData import update_project
+    from deleteData import delete_project
+    from listDriveTree import iter_drive_tree
+
+    db = get_firestore_client()
+    project_name = f"bench-{count}-{int(time.time())}"
+    workdir = tempfile.mkdtemp(prefix="cows-benchmark-")
+    results = []
+    try:
+        upload_gate_dir = os.path.join(workdir, "uploadGate")
+        _write_upload_gate(upload_gate_dir, count, args.file_size)
+
+        scenarios = [
+            ('upload', lambda: process_images_from_uploadgate(
+                db, project_name, upload_gate_dir, max_workers=args.workers, sharing=args.sharing)),
+            ('list_tree', lambda: list(iter_drive_tree(max_workers=args.workers))),
+            ('download', lambda: download_project_images(
+                project_name, os.path.join(workdir, "downloads"), max_workers=args.workers)),
+            ('update', lambda: update_project(project_name, {'label': ['benchmark']}, bulk=args.bulk)),
+            ('delete', lambda: delete_project(project_name, bulk=args.bulk)),
+        ]
+        for name, func in scenarios:
+            if name in args.scenarios:
+                results.append(run_scenario(name, count, server, func))
+            elif name == 'upload':
+                # The other scenarios need the project's images in place
+                func()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the package against a local fake Drive and the Firestore emulator")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated project sizes in images (default: 1000,10000,100000)")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--workers', type=int, default=16, help="max_workers passed to the package")
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help="Bytes per generated image")
+    parser.add_argument('--sharing', default='batch', choices=('per_file', 'inherit', 'batch'))
+    parser.add_argument('--single', dest='bulk', action='store_false',
+                        help="Update and delete images one by one instead of in bulk")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every Drive request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Largest deviation from --latency")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of Drive requests answered with 429 or 503")
+    parser.add_argument('--drive-qps', type=float, default=1000.0,
+                        help="DRIVE_REQUESTS_PER_SECOND for the run (the quota is not the subject here)")
+    parser.add_argument('--json', help="Write the results to this file")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Never let a benchmark touch the real services
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        print("FIRESTORE_EMULATOR_HOST is not set. Start the emulator first, e.g.\n"
+              "  gcloud emulators firestore start --host-port=127.0.0.1:8080\n"
+              "  export FIRESTORE_EMULATOR_HOST=127.0.0.1:8080")
+        sys.exit(1)
+
+    server = FakeDriveServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    server.create_folder('images')
+    workdir = tempfile.mkdtemp(prefix="cows-benchmark-state-")
+
+    # Configure the package before it is imported, as some settings are read at import
+    os.environ['DRIVE_API_ROOT'] = server.url
+    os.environ['DRIVE_EMULATOR'] = '1'
+    os.environ['DRIVE_REQUESTS_PER_SECOND'] = str(args.drive_qps)
+    os.environ['DRIVE_UPLOAD_JOURNAL'] = os.path.join(workdir, "upload_journal.json")
+    for name in ('GOOGLE_DRIVE_CREDENTIALS_JSON', 'DRIVE_FOLDER_CACHE'):
+        os.environ.pop(name, None)
+
+    print(f"Fake Drive at {server.url} (latency {args.latency}s +/- {args.jitter}s, "
+          f"error rate {args.error_rate}); Firestore emulator at {os.environ['FIRESTORE_EMULATOR_HOST']}")
+    results = []
+    try:
+        for size in (int(size) for size in args.sizes.split(",") if size.strip()):
+            results.extend(benchmark_size(size, server, args))
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+
+# The Google client libraries are imported inside the getters below, so importing
+# this module does no I/O. The data modules likewise import firebase_admin.firestore,
+# which loads grpc, only inside the functions that query Firestore
+
+# Scopes used by the data modules, and by the driveController maintenance scripts
+DRIVE_FILE_SCOPES = ('https://www.googleapis.com/auth/drive.file',)
+DRIVE_FULL_SCOPES = ('https://www.googleapis.com/auth/drive',)
+
+# Seconds before an idle Drive HTTP request gives up
+HTTP_TIMEOUT = 60
+
+# Project used with the Firestore emulator when no Firebase credentials are set
+EMULATOR_PROJECT_ID = "demo-cows-detector"
+
+_lock = threading.Lock()
+_thread_local = threading.local()
+_drive_credentials = {}
+
+def get_firebase_app():
+    """Return the default Firebase app, initialising it on first use."""
+    import firebase_admin
+    from firebase_admin import credentials
+    with _lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS_JSON")
+            if not firebase_cred_path and os.getenv("FIRESTORE_EMULATOR_HOST"):
+                # The emulator accepts unauthenticated requests for any project
+                class EmulatorCredential(credentials.Base):
+                    def get_credential(self):
+                        from google.auth.credentials import AnonymousCredentials
+                        return AnonymousCredentials()
+                project_id = os.getenv("GOOGLE_CLOUD_PROJECT", EMULATOR_PROJECT_ID)
+                return firebase_admin.initialize_app(EmulatorCredential(), {'projectId': project_id})
+            if not firebase_cred_path:
+                raise ValueError("FIREBASE_CREDENTIALS_JSON environment variable is not set")
+            return firebase_admin.initialize_app(credentials.Certificate(firebase_cred_path))
+
+def get_firestore_client():
+    """Return the Firestore client of the shared Firebase app (safe to share across threads)."""
+    from firebase_admin import firestore
+    return firestore.client(get_firebase_app())
+
+def get_drive_credentials(scopes=DRIVE_FILE_SCOPES):
+    """
+    Return service account credentials for Drive, loaded once per set of scopes
+
+    With DRIVE_EMULATOR=1, anonymous credentials are returned instead, for a local
+    stand-in that DRIVE_API_ROOT must point at. DRIVE_API_ROOT alone keeps using
+    the service account.
+    """
+    from google.oauth2 import service_account
+    scopes = tuple(scopes)
+    with _lock:
+        if scopes not in _drive_credentials:
+            drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
+            if os.getenv("DRIVE_EMULATOR", "").lower() in ("1", "true", "yes"):
+                if not os.getenv("DRIVE_API_ROOT"):
+                    raise ValueError("DRIVE_EMULATOR is set but DRIVE_API_ROOT is not")
+                from google.auth.credentials import AnonymousCredentials
+                _drive_credentials[scopes] = AnonymousCredentials()
+                return _drive_credentials[scopes]
+            if not drive_cred_path:
+                raise ValueError("GOOGLE_DRIVE_CREDENTIALS_JSON environment variable is not set")
+            _drive_credentials[scopes] = service_account.Credentials.from_service_account_file(
+                drive_cred_path, scopes=list(scopes))
+        return _drive_credentials[scopes]
+
+def get_drive_service(scopes=DRIVE_FILE_SCOPES):
+    """
+    Return a Drive service for the calling thread
+
+    httplib2 transports are not thread-safe, so each thread gets its own service
+    per set of scopes. A thread's service keeps its HTTP connection alive and reuses
+    it for every call made from that thread. The service is built from the discovery
+    document bundled with google-api-python-client, so no network fetch is needed,
+    and its requests run through rate_limiter.drive_scheduler. Set DRIVE_API_ROOT
+    (e.g. "http://127.0.0.1:8765/") to send every request, including uploads and
+    batch requests, to a local stand-in such as benchmark/fake_drive.py.
+    """
+    scopes = tuple(scopes)
+    services = getattr(_thread_local, 'drive_services', None)
+    if services is None:
+        services = _thread_local.drive_services = {}
+    service = services.get(scopes)
+    if service is None:
+        import google_auth_httplib2
+        from googleapiclient.discovery import build, build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
+        from googleapiclient.http import build_http
+        from rate_limiter import scheduled_request_class
+        # build_http() stops httplib2 from following 308, which resumable uploads
+        # use for "resume incomplete"
+        transport = build_http()
+        transport.timeout = HTTP_TIMEOUT
+        http = google_auth_httplib2.AuthorizedHttp(get_drive_credentials(scopes), http=transport)
+        api_root = os.getenv("DRIVE_API_ROOT")
+        if api_root:
+            # Rewriting rootUrl in the bundled document also moves the upload and
+            # batch endpoints, which client_options.api_endpoint leaves in place
+            document = json.loads(get_static_doc('drive', 'v3'))
+            document['rootUrl'] = api_root.rstrip('/') + '/'
+            service = build_from_document(
+                document, http=http, requestBuilder=scheduled_request_class())
+        else:
+            service = build(
+                'drive', 'v3', http=http, cache_discovery=False, static_discovery=True,
+                requestBuilder=scheduled_request_class())
+        services[scopes] = service
+    return service
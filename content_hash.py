@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import firestore_scheduler
+
+DEFAULT_HASH_INDEX_PATH = os.getenv("CONTENT_HASH_INDEX", "./content_hash_index.json")
+
+# Bytes read per step when hashing, so large files are never held in memory
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Documents read per get_all call when checking that matched images still exist
+VERIFY_CHUNK_SIZE = 500
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file, reading it in chunks."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class ContentHashIndex:
+    """
+    Local cache mapping content hashes to the IDs of images already stored
+
+    The cache is a JSON file refreshed incrementally from the content_hash field of
+    image documents created since the last refresh. Deleted images are not seen by
+    a refresh, so find_duplicates checks each match against Firestore and removes
+    hashes whose image is gone.
+
+    Args:
+        path (str): JSON file the index is persisted to
+    """
+
+    def __init__(self, path=DEFAULT_HASH_INDEX_PATH):
+        self.path = path
+        self.hashes = {}
+        self.synced_at = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                self.hashes = data.get('hashes', {})
+                self.synced_at = data.get('synced_at')
+            except Exception as e:
+                print(f"Warning: Could not read content hash index {path}: {e}")
+
+    def refresh(self, db):
+        """Add the hashes of image documents created since the last refresh."""
+        started_at = time.time()
+        query = db.collection('images')
+        if self.synced_at is not None:
+            query = query.where('created_at', '>', datetime.fromtimestamp(self.synced_at, tz=timezone.utc))
+        count = 0
+        for doc in firestore_scheduler.stream(query.select(['id', 'content_hash']).stream, operation='firestore.query.stream'):
+            data = doc.to_dict()
+            if data.get('content_hash'):
+                with self._lock:
+                    self.hashes.setdefault(data['content_hash'], data.get('id'))
+                count += 1
+        # Leave a margin for documents committed while the query was running
+        self.synced_at = started_at - 60
+        self.save()
+        print(f"Loaded {count} content hashes into {self.path}")
+
+    def get(self, content_hash):
+        with self._lock:
+            return self.hashes.get(content_hash)
+
+    def add(self, content_hash, image_id):
+        with self._lock:
+            self.hashes.setdefault(content_hash, image_id)
+
+    def remove(self, content_hash):
+        with self._lock:
+            self.hashes.pop(content_hash, None)
+
+    def save(self):
+        with self._lock:
+            data = {'hashes': self.hashes, 'synced_at': self.synced_at}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+def _stale_hashes(db, matches):
+    """Return the hashes in matches whose image document is gone or now holds other content."""
+    def get_all(refs):
+        return list(db.get_all(refs, field_paths=['content_hash']))
+
+    by_id = {str(image_id): content_hash for content_hash, image_id in matches.items()}
+    image_ids = list(by_id)
+    stale = set()
+    for start in range(0, len(image_ids), VERIFY_CHUNK_SIZE):
+        refs = [db.collection('images').document(image_id) for image_id in image_ids[start:start + VERIFY_CHUNK_SIZE]]
+        snapshots = firestore_scheduler.call(get_all, refs, cost=len(refs), operation='firestore.document.get_all')
+        current = {snapshot.id: snapshot.to_dict().get('content_hash') for snapshot in snapshots if snapshot.exists}
+        for ref in refs:
+            if current.get(ref.id) != by_id[ref.id]:
+                stale.add(by_id[ref.id])
+    return stale
+
+def find_duplicates(images_dir, image_files, hash_index, max_workers=1, db=None):
+    """
+    Hash image files and split them into new content and already-known content
+
+    Files repeated within image_files are also reported as duplicates of the first
+    occurrence. With db, every match in hash_index is checked against its image
+    document first; matches whose image was deleted or replaced are removed from
+    the index and the file counts as new.
+
+    Args:
+        images_dir (str): Directory containing the files
+        image_files (list): File names to check, in processing order
+        hash_index (ContentHashIndex): Index of known content hashes
+        max_workers (int): Files hashed concurrently
+        db (optional): Firestore database instance used to check matches
+
+    Returns:
+        tuple: (list of (image_file, content_hash) to upload in the original order,
+            dict mapping each duplicate file name to the existing image ID or, for a
+            repeat within the batch, the name of the first file)
+    """
+    paths = [os.path.join(images_dir, image_file) for image_file in image_files]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        hashes = list(executor.map(hash_file, paths))
+
+    matches = {content_hash: hash_index.get(content_hash) for content_hash in set(hashes)}
+    matches = {content_hash: image_id for content_hash, image_id in matches.items() if image_id is not None}
+    if db is not None and matches:
+        stale = _stale_hashes(db, matches)
+        for content_hash in stale:
+            print(f"Image {matches.pop(content_hash)} no longer holds content {content_hash[:12]}, dropping it from the index")
+            hash_index.remove(content_hash)
+        if stale:
+            # Saved now so a later run does not trust the removed hashes again
+            hash_index.save()
+
+    unique = []
+    duplicates = {}
+    seen = {}
+    for image_file, content_hash in zip(image_files, hashes):
+        existing_id = matches.get(content_hash)
+        if existing_id is not None:
+            duplicates[image_file] = existing_id
+        elif content_hash in seen:
+            duplicates[image_file] = seen[content_hash]
+        else:
+            seen[content_hash] = image_file
+            unique.append((image_file, content_hash))
+    return unique, duplicates
@@ -1,22 +1,10 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-import os
+from clients import get_drive_service, get_firestore_client
+from rate_limiter import drive_scheduler, firestore_scheduler
+from googleapiclient.errors import HttpError
 
-# Get credential paths from environment variables
-firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS_JSON")
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
-
-# Initialize Firebase Admin SDK
-firebase_cred = credentials.Certificate(firebase_cred_path)
-firebase_admin.initialize_app(firebase_cred)
-
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
+# Drive accepts at most 100 calls per batch request, Firestore 500 writes per commit
+DRIVE_BATCH_SIZE = 100
+FIRESTORE_BATCH_SIZE = 500
 
 def delete_image(image_id):
     """
@@ -29,33 +17,34 @@ def delete_image(image_id):
         bool: True if deletion was successful, False otherwise
     """
     try:
-        db = firestore.client()
+        db = get_firestore_client()
         
         # Get the document
         doc_ref = db.collection('images').document(str(image_id))
-        doc = doc_ref.get()
+        doc = firestore_scheduler.call(doc_ref.get, operation='firestore.document.get')
         
         if not doc.exists:
             print(f"Image with ID {image_id} not found")
             return False
             
-        # Get the Drive file ID
-        drive_file_id = doc.to_dict().get('drive_file_id')
+        # Get the Drive file IDs of the image and its thumbnail, if any
+        doc_data = doc.to_dict()
+        drive_file_ids = [doc_data.get('drive_file_id'), doc_data.get('thumbnail_drive_file_id')]
         
-        # Delete the file from Drive if it exists
-        if drive_file_id:
+        # Delete the files from Drive if they exist
+        for drive_file_id in filter(None, drive_file_ids):
             try:
-                drive_service.files().delete(fileId=drive_file_id).execute()
+                get_drive_service().files().delete(fileId=drive_file_id).execute()
                 print(f"Deleted file from Drive: {drive_file_id}")
             except Exception as e:
                 print(f"Warning: Could not delete file from Drive: {e}")
         
         # Delete the document from Firestore
-        doc_ref.delete()
+        firestore_scheduler.call(doc_ref.delete, operation='firestore.document.delete')
         print(f"Successfully deleted image document with ID: {image_id}")
         
         # Verify the deletion
-        deleted_doc = doc_ref.get()
+        deleted_doc = firestore_scheduler.call(doc_ref.get, operation='firestore.document.get')
         if not deleted_doc.exists:
             print("Verified document deletion")
             return True
@@ -67,21 +56,123 @@ def delete_image(image_id):
         print(f"Error deleting image document: {e}")
         return False
 
-def delete_project(project_name):
+def delete_drive_files(file_ids):
+    """
+    Delete Drive files using batch requests of up to 100 calls each
+    
+    Args:
+        file_ids (list): IDs of the Drive files to delete
+        
+    Returns:
+        dict: Maps each file ID that could not be deleted to the error message.
+            Files that no longer exist count as deleted.
+    """
+    failed = {}
+    drive_service = get_drive_service()
+    for start in range(0, len(file_ids), DRIVE_BATCH_SIZE):
+        chunk = file_ids[start:start + DRIVE_BATCH_SIZE]
+        requests = [(file_id, drive_service.files().delete(fileId=file_id)) for file_id in chunk]
+        try:
+            results = drive_scheduler.execute_batch(drive_service.new_batch_http_request, requests)
+        except Exception as e:
+            for file_id in chunk:
+                failed.setdefault(file_id, str(e))
+            continue
+        for file_id, (_, exception) in results.items():
+            if exception is None:
+                continue
+            if isinstance(exception, HttpError) and exception.resp.status == 404:
+                continue
+            failed[file_id] = str(exception)
+    return failed
+
+def bulk_delete_project(project_name, page_size=FIRESTORE_BATCH_SIZE):
+    """
+    Delete all images from a project using Drive batch requests and batched Firestore deletes
+    
+    Documents are streamed a page at a time. A document is only deleted once its
+    Drive file is gone, so images whose file could not be deleted stay in Firestore
+    and can be retried.
+    
+    Args:
+        project_name (str): Name of the project to delete
+        page_size (int): Documents fetched and deleted per page, at most 500
+        
+    Returns:
+        dict: 'deleted' count, plus 'drive_failed' and 'firestore_failed' lists of
+            {'id', 'error'} entries for the images that were not deleted
+    """
+    db = get_firestore_client()
+    page_size = min(page_size, FIRESTORE_BATCH_SIZE)
+    result = {'deleted': 0, 'drive_failed': [], 'firestore_failed': []}
+
+    query = (db.collection('images')
+             .where('project', '==', project_name)
+             .order_by('id')
+             # The cursor of the next page is built from the 'id' of the last document
+             .select(['id', 'drive_file_id', 'thumbnail_drive_file_id'])
+             .limit(page_size))
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(firestore_scheduler.stream(page_query.stream, operation='firestore.query.stream'))
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        # Remove the Drive files first so no document is left pointing at nothing
+        file_ids = {
+            doc.id: [file_id for file_id in (doc.to_dict().get('drive_file_id'),
+                                             doc.to_dict().get('thumbnail_drive_file_id')) if file_id]
+            for doc in docs
+        }
+        drive_failed = delete_drive_files([file_id for ids in file_ids.values() for file_id in ids])
+
+        batch = db.batch()
+        batch_ids = []
+        for doc in docs:
+            errors = [drive_failed[file_id] for file_id in file_ids[doc.id] if file_id in drive_failed]
+            if errors:
+                result['drive_failed'].append({'id': doc.id, 'error': errors[0]})
+                continue
+            batch.delete(doc.reference)
+            batch_ids.append(doc.id)
+
+        if batch_ids:
+            try:
+                firestore_scheduler.call(batch.commit, cost=len(batch_ids), operation='firestore.batch.commit')
+                result['deleted'] += len(batch_ids)
+            except Exception as e:
+                result['firestore_failed'].extend({'id': doc_id, 'error': str(e)} for doc_id in batch_ids)
+        print(f"Deleted {result['deleted']} images from project {project_name} so far")
+
+        if len(docs) < page_size:
+            break
+
+    print(f"Deleted {result['deleted']} images from project {project_name} "
+          f"({len(result['drive_failed'])} Drive failures, {len(result['firestore_failed'])} Firestore failures)")
+    return result
+
+def delete_project(project_name, bulk=False):
     """
     Delete all images from a specific project
     
     Args:
         project_name (str): Name of the project to delete
+        bulk (bool): Use bulk_delete_project instead of deleting images one by one
         
     Returns:
         bool: True if deletion was successful, False otherwise
     """
     try:
-        db = firestore.client()
+        if bulk:
+            result = bulk_delete_project(project_name)
+            return not result['drive_failed'] and not result['firestore_failed']
+
+        db = get_firestore_client()
         
         # Query all documents for the project
-        docs = db.collection('images').where('project', '==', project_name).stream()
+        docs = firestore_scheduler.stream(db.collection('images').where('project', '==', project_name).stream, operation='firestore.query.stream')
         
         success = True
         for doc in docs:
@@ -105,5 +196,8 @@ if __name__ == "__main__":
         # Delete all images from a project
         delete_project("Claving")
         
+        # Delete a large project with batched Drive and Firestore requests
+        # delete_project("Claving", bulk=True)
+        
     except Exception as e:
         print(f"Error during deletion: {e}") 
\ No newline at end of file
@@ -1,33 +1,173 @@
 from drive_utils import convert_datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from clients import get_drive_service, get_firestore_client
+from rate_limiter import drive_scheduler, firestore_scheduler
+from metrics import metrics
 from googleapiclient.http import MediaIoBaseDownload
+import io
 import os
 import json
+import hashlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from ccmd_logger import Logger
 
 logger = Logger('cows_detector')
 
-# Get credential paths from environment variables
+# Get credential path from environment variable (reported by check_firebase_connection)
 firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS_JSON")
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
 
-# Initialize Firebase Admin SDK
-firebase_cred = credentials.Certificate(firebase_cred_path)
-firebase_admin.initialize_app(firebase_cred)
+# Log aggregate progress every N images during bulk downloads
+PROGRESS_INTERVAL = 100
 
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
+# Name of the manifest written into a project directory by incremental downloads
+MANIFEST_FILENAME = "manifest.json"
+
+# What the download functions fetch: the stored image, or its thumbnail
+VARIANT_ORIGINAL = 'original'
+VARIANT_THUMBNAIL = 'thumbnail'
+
+# Returned by download jobs that found the image already up to date on disk
+SKIPPED = object()
+
+# Files of at least this many bytes are fetched as concurrent HTTP Range requests.
+# Unset (the default) keeps every download on a single stream, which saves the
+# metadata request needed to learn a file's size
+RANGED_DOWNLOAD_THRESHOLD = int(os.getenv("DRIVE_RANGED_DOWNLOAD_THRESHOLD", "0")) or None
+
+# Bytes per Range request, and Range requests in flight per file
+RANGE_SIZE = 8 * 1024 * 1024
+RANGE_WORKERS = 8
+
+# Threads fetching ranges, shared by all files downloaded concurrently
+RANGE_POOL_SIZE = int(os.getenv("DRIVE_RANGE_POOL_SIZE", str(RANGE_WORKERS * 4)))
+
+_range_pool = None
+_range_pool_lock = threading.Lock()
+
+def _get_range_pool():
+    """Return the process-wide range thread pool, creating it on first use."""
+    global _range_pool
+    with _range_pool_lock:
+        if _range_pool is None:
+            _range_pool = ThreadPoolExecutor(max_workers=max(1, RANGE_POOL_SIZE),
+                                             thread_name_prefix='drive-range')
+        return _range_pool
+
+# Image documents resolved per get_all call when downloading by ID
+GET_ALL_CHUNK_SIZE = 500
+
+class DownloadReport:
+    """Aggregate outcome of a bulk download.
+
+    Evaluates to True when every image was downloaded, so callers that only
+    check the result for truthiness keep working.
+    """
+
+    def __init__(self):
+        self.succeeded = 0
+        self.skipped = 0
+        self.failed = []  # list of (image_id, reason) tuples
+        self._lock = threading.Lock()
+
+    @property
+    def processed(self):
+        return self.succeeded + self.skipped + len(self.failed)
+
+    def record(self, image_id, error=None, skipped=False):
+        with self._lock:
+            if error is not None:
+                self.failed.append((image_id, error))
+            elif skipped:
+                self.skipped += 1
+            else:
+                self.succeeded += 1
+            processed = self.processed
+        if processed % PROGRESS_INTERVAL == 0:
+            logger.info(f"Progress: {processed} images processed ({self.skipped} unchanged, {len(self.failed)} failed)")
+
+    def to_dict(self):
+        return {
+            'processed': self.processed,
+            'succeeded': self.succeeded,
+            'skipped': self.skipped,
+            'failed': [{'id': image_id, 'error': error} for image_id, error in self.failed]
+        }
+
+    def __bool__(self):
+        return not self.failed
+
+class DownloadManifest:
+    """
+    Record of what an incremental download has already written to disk
+
+    Maps each image ID to its drive_file_id, Drive md5Checksum, size, updated_at
+    and local filename, and is stored as JSON next to the downloaded images.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._dirty = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.error(f"Could not read manifest {path}, starting a new one: {e}")
+
+    def is_current(self, image_id, image_data, image_path, variant=VARIANT_ORIGINAL):
+        """True if the image on disk matches the manifest entry and the document is unchanged."""
+        with self._lock:
+            entry = self.entries.get(str(image_id))
+        if not entry or not os.path.exists(image_path):
+            return False
+        return (
+            entry.get('drive_file_id') == get_drive_file_id(image_data, variant)
+            and entry.get('updated_at') == convert_datetime(image_data.get('updated_at'))
+            and entry.get('size') == os.path.getsize(image_path)
+        )
+
+    def update(self, image_id, entry):
+        with self._lock:
+            self.entries[str(image_id)] = entry
+            self._dirty += 1
+            should_save = self._dirty >= PROGRESS_INTERVAL
+        if should_save:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = 0
+
+def get_drive_file_id(image_data, variant=VARIANT_ORIGINAL):
+    """Return the Drive file ID of an image document, parsing the URL for older documents."""
+    if variant == VARIANT_THUMBNAIL:
+        return image_data.get('thumbnail_drive_file_id')
+    file_id = image_data.get('drive_file_id')
+    if file_id:
+        return file_id
+    image_url = image_data.get('image', '')
+    if 'drive.google.com' in image_url:
+        return image_url.split('/d/')[1].split('/')[0]
+    return image_url or None
+
+def _md5_of_file(path, chunk_size=1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
 
 def check_firebase_connection():
     """Test the connection to Firebase by creating and deleting a test document."""
     try:
-        db = firestore.client()
+        db = get_firestore_client()
         test_doc = db.collection('test').document('test')
         test_doc.set({'test': 'connection'})
         test_doc.delete()
@@ -41,29 +181,135 @@ def check_firebase_connection():
             logger.error("Firebase credentials file not found!")
         return False
 
-def download_image(image_url, save_path):
+def download_file_ranged(file_id, save_path, size, md5_checksum=None, range_size=RANGE_SIZE, max_workers=RANGE_WORKERS):
+    """
+    Download a Drive file as concurrent HTTP Range requests
+
+    The ranges are written at their offsets into a file preallocated to the full
+    size, which replaces save_path only once the whole file has been fetched and
+    matches md5_checksum. Ranges run on a thread pool shared by all files, so
+    concurrent downloads do not each start their own threads.
+
+    Args:
+        file_id (str): Drive file ID
+        save_path (str): Path to save the file to
+        size (int): File size in bytes, as reported by Drive
+        md5_checksum (str, optional): Drive's md5Checksum of the file
+        range_size (int): Bytes per Range request
+        max_workers (int): Range requests of this file in flight
+
+    Raises:
+        IOError: If a range comes back short or the checksum does not match
+    """
+    part_path = f"{save_path}.part"
+    with open(part_path, 'wb') as f:
+        f.truncate(size)
+
+    def fetch_range(start):
+        end = min(start + range_size, size) - 1
+        request = get_drive_service().files().get_media(fileId=file_id)
+        request.headers['Range'] = f"bytes={start}-{end}"
+        content = request.execute()
+        if len(content) != end - start + 1:
+            raise IOError(f"Expected {end - start + 1} bytes at offset {start}, got {len(content)}")
+        with open(part_path, 'r+b') as f:
+            f.seek(start)
+            f.write(content)
+
+    pool = _get_range_pool()
+    pending = set()
     try:
-        # Extract file ID from Google Drive URL if full URL is provided
-        if 'drive.google.com' in image_url:
-            file_id = image_url.split('/d/')[1].split('/')[0]
-        else:
-            file_id = image_url
-            
-        # Get the file content from Google Drive using file ID
-        request = drive_service.files().get_media(fileId=file_id)
-        
-        with open(save_path, 'wb') as f:
-            # Download the file in chunks
-            downloader = MediaIoBaseDownload(f, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-        logger.info(f"Successfully downloaded image to {save_path}")
+        for start in range(0, size, range_size):
+            if len(pending) >= max(1, max_workers):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()  # re-raises a failed range
+            pending.add(pool.submit(fetch_range, start))
+        done, pending = wait(pending)
+        for future in done:
+            future.result()
+        if md5_checksum and _md5_of_file(part_path) != md5_checksum:
+            raise IOError(f"Checksum mismatch for Drive file {file_id}")
+    except Exception:
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        os.remove(part_path)
+        raise
+    os.replace(part_path, save_path)
+
+def download_image(image_url, save_path, ranged_threshold=RANGED_DOWNLOAD_THRESHOLD, drive_meta=None):
+    """
+    Download a Drive file to save_path
+
+    Args:
+        image_url (str): Drive file ID or sharing URL
+        save_path (str): Path to save the file to
+        ranged_threshold (int, optional): Files of at least this many bytes are
+            fetched with download_file_ranged. When set, every download first reads
+            the file's size and md5Checksum and is verified against the checksum
+        drive_meta (dict, optional): The file's 'md5Checksum' and 'size' if the
+            caller has already read them; the download is verified against the
+            checksum and no metadata request is made
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        _download_file(image_url, save_path, ranged_threshold, drive_meta)
         return True
     except Exception as e:
         logger.error(f"Error downloading image from Google Drive: {e}")
         return False
 
+def _download_file(image_url, save_path, ranged_threshold, drive_meta):
+    """Do the work of download_image, raising on failure instead of logging."""
+    # Extract file ID from Google Drive URL if full URL is provided
+    if 'drive.google.com' in image_url:
+        file_id = image_url.split('/d/')[1].split('/')[0]
+    else:
+        file_id = image_url
+
+    if drive_meta is None and ranged_threshold:
+        drive_meta = get_drive_service().files().get(fileId=file_id, fields='md5Checksum, size').execute()
+    md5_checksum = drive_meta.get('md5Checksum') if drive_meta else None
+    if drive_meta and ranged_threshold:
+        size = int(drive_meta.get('size', 0))
+        if size >= ranged_threshold:
+            download_file_ranged(file_id, save_path, size, md5_checksum)
+            logger.info(f"Successfully downloaded image to {save_path} in {-(-size // RANGE_SIZE)} ranges")
+            return
+
+    # Get the file content from Google Drive using file ID
+    request = get_drive_service().files().get_media(fileId=file_id)
+    
+    # Download to a temporary name so an interrupted download never looks complete
+    part_path = f"{save_path}.part"
+    with open(part_path, 'wb') as f:
+        # Download the file in chunks
+        _download_chunks(MediaIoBaseDownload(f, request))
+    if md5_checksum and _md5_of_file(part_path) != md5_checksum:
+        os.remove(part_path)
+        raise IOError(f"Checksum mismatch for Drive file {file_id}")
+    os.replace(part_path, save_path)
+    logger.info(f"Successfully downloaded image to {save_path}")
+
+def _download_chunks(downloader):
+    """Run a MediaIoBaseDownload to completion, one scheduled request per chunk."""
+    received = 0
+    done = False
+    while not done:
+        status, done = drive_scheduler.call(downloader.next_chunk, operation='drive.files.get_media')
+        metrics.add_bytes('drive.files.get_media', received=status.resumable_progress - received)
+        received = status.resumable_progress
+
+def download_image_bytes(file_id):
+    """Download a Drive file into memory and return its content as bytes."""
+    request = get_drive_service().files().get_media(fileId=file_id)
+    buffer = io.BytesIO()
+    _download_chunks(MediaIoBaseDownload(buffer, request))
+    return buffer.getvalue()
+
 def save_metadata(metadata, save_path):
     try:
         with open(save_path, 'w') as f:
@@ -74,81 +320,307 @@ def save_metadata(metadata, save_path):
         logger.error(f"Error saving metadata: {e}")
         return False
 
-def download_image_and_metadata(image_id, output_dir):
+def _manifest_filename(variant):
+    if variant == VARIANT_THUMBNAIL:
+        return f"manifest_{variant}.json"
+    return MANIFEST_FILENAME
+
+def _image_filename(image_id, image_data, variant=VARIANT_ORIGINAL):
+    original_name = image_data.get('original_name', 'image.jpg')
+    if variant == VARIANT_THUMBNAIL:
+        return f"{image_id}_{os.path.splitext(original_name)[0]}_thumb.jpg"
+    return f"{image_id}_{original_name}"
+
+def _download_document(image_id, image_data, output_dir, manifest=None, variant=VARIANT_ORIGINAL):
+    """
+    Download one image, or its thumbnail, and write its metadata
+
+    With a manifest, images already on disk and unchanged are skipped, and each
+    download is checked against Drive's md5Checksum and recorded.
+
+    Returns:
+        None on success, SKIPPED if the image was up to date, or an error message
+    """
+    if variant == VARIANT_THUMBNAIL:
+        image_url = image_data.get('thumbnail_drive_file_id')
+        if not image_url:
+            return f"No thumbnail stored for image {image_id}"
+    else:
+        image_url = image_data.get('image')
+        if not image_url:
+            return f"No image URL found for image {image_id}"
+
+    image_filename = _image_filename(image_id, image_data, variant)
+    image_path = os.path.join(output_dir, image_filename)
+    if manifest is not None and manifest.is_current(image_id, image_data, image_path, variant):
+        return SKIPPED
+
+    # Thumbnails are small, so they always come down in a single request
+    ranged_threshold = None if variant == VARIANT_THUMBNAIL else RANGED_DOWNLOAD_THRESHOLD
+    drive_meta = None
+    if manifest is not None:
+        # Read once: download_image verifies against it and the manifest records it
+        file_id = get_drive_file_id(image_data, variant)
+        drive_meta = get_drive_service().files().get(fileId=file_id, fields='md5Checksum, size').execute()
+    try:
+        # Not download_image: the error is returned, and logged once by the caller
+        _download_file(image_url, image_path, ranged_threshold, drive_meta)
+    except Exception as e:
+        return f"Failed to download image file for image {image_id}: {e}"
+
+    metadata_path = os.path.join(output_dir, f"{image_id}_metadata.json")
+    if not save_metadata(image_data, metadata_path):
+        return f"Failed to save metadata for image {image_id}"
+
+    if manifest is not None:
+        manifest.update(image_id, {
+            'drive_file_id': file_id,
+            'md5Checksum': drive_meta.get('md5Checksum'),
+            'size': os.path.getsize(image_path),
+            'updated_at': convert_datetime(image_data.get('updated_at')),
+            'filename': image_filename
+        })
+    return None
+
+def _fetch_and_download(image_id, output_dir, variant=VARIANT_ORIGINAL):
+    """Fetch an image document from Firestore and download it."""
+    db = get_firestore_client()
+    doc = firestore_scheduler.call(
+        db.collection('images').document(str(image_id)).get, operation='firestore.document.get')
+    if not doc.exists:
+        return f"Image with ID {image_id} not found"
+    return _download_document(image_id, doc.to_dict(), output_dir, variant=variant)
+
+def download_image_and_metadata(image_id, output_dir, variant=VARIANT_ORIGINAL):
     try:
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
-        
-        # Get image document from Firestore
-        db = firestore.client()
-        doc_ref = db.collection('images').document(str(image_id))
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            logger.error(f"Image with ID {image_id} not found")
-            return False
-            
-        image_data = doc.to_dict()
-        # Download image
-        image_url = image_data.get('image')
 
-        if not image_url:
-            logger.error(f"No image URL found for image {image_id}")
-            return False
-            
-        image_filename = f"{image_id}_{image_data.get('original_name', 'image.jpg')}"
-        image_path = os.path.join(output_dir, image_filename)
-        
-        if not download_image(image_url, image_path):
+        error = _fetch_and_download(image_id, output_dir, variant)
+        if error:
+            logger.error(error)
             return False
-            
-        # Save metadata
-        metadata_filename = f"{image_id}_metadata.json"
-        metadata_path = os.path.join(output_dir, metadata_filename)
-        
-        if not save_metadata(image_data, metadata_path):
-            return False
-            
         return True
-        
+
     except Exception as e:
         logger.error(f"Error downloading image and metadata: {e}")
         return False
 
-def download_project_images(project_name, output_dir, limit=None):
+def _run_downloads(jobs, report, max_workers):
+    """
+    Run download jobs, keeping at most max_workers of them in flight
+
+    Args:
+        jobs (iterable): (image_id, callable) pairs; each callable returns None on
+            success, SKIPPED if nothing needed downloading, or an error message
+        report (DownloadReport): Collects the outcome of every job
+        max_workers (int): Number of concurrent downloads
+    """
+    def run(image_id, job):
+        try:
+            error = job()
+        except Exception as e:
+            error = str(e)
+        if error is SKIPPED:
+            report.record(image_id, skipped=True)
+            return
+        if error:
+            logger.error(f"Failed to download image {image_id}: {error}")
+        report.record(image_id, error)
+
+    if max_workers <= 1:
+        for image_id, job in jobs:
+            run(image_id, job)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for image_id, job in jobs:
+            # Bound the number of queued jobs so a large stream is not buffered in memory
+            if len(pending) >= max_workers * 2:
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending.add(executor.submit(run, image_id, job))
+        wait(pending)
+
+def download_project_images(project_name, output_dir, limit=None, max_workers=1, incremental=False,
+                            variant=VARIANT_ORIGINAL):
+    """
+    Download every image and its metadata from a project
+
+    Args:
+        project_name (str): Name of the project to download
+        output_dir (str): Directory to download into; a sub-directory named after
+            the project is created
+        limit (int, optional): Maximum number of images to download
+        max_workers (int): Number of images downloaded concurrently
+        incremental (bool): Keep a manifest in the project directory and only
+            download images that are new or changed since the last run
+        variant (str): VARIANT_ORIGINAL for the stored images, or VARIANT_THUMBNAIL
+            for their thumbnails; images without a thumbnail are reported as failed
+
+    Returns:
+        DownloadReport: Counts and per-image failures; truthy if all images succeeded
+    """
+    report = DownloadReport()
+    manifest = None
     try:
-        db = firestore.client()
+        db = get_firestore_client()
         # Query all documents for the project using where() instead of filter()
+        from firebase_admin import firestore
         query = db.collection('images').where('project', '==', project_name).order_by('id', direction=firestore.Query.ASCENDING)
         if limit is not None:
             query = query.limit(limit)
-        docs = query.stream()
+        docs = firestore_scheduler.stream(query.stream, operation='firestore.query.stream')
         logger.info(f"Found documents for project {project_name}" + str(docs))
-        success = True
-        for doc in docs:
-            # Create project-specific directory
-            project_dir = os.path.join(output_dir, project_name)
-            if not download_image_and_metadata(doc.id, project_dir):
-                success = False
-                logger.error(f"Failed to download image {doc.id} from project {project_name}")
-        
-        return success
-        
+
+        # Create project-specific directory
+        project_dir = os.path.join(output_dir, project_name)
+        os.makedirs(project_dir, exist_ok=True)
+        if incremental:
+            manifest = DownloadManifest(os.path.join(project_dir, _manifest_filename(variant)))
+
+        # The streamed documents already carry the metadata, so no second read is needed
+        jobs = (
+            (doc.id, lambda doc=doc: _download_document(doc.id, doc.to_dict(), project_dir, manifest, variant))
+            for doc in docs
+        )
+        _run_downloads(jobs, report, max_workers)
+
+        logger.info(f"Downloaded {report.succeeded} images from project {project_name} "
+                    f"({report.skipped} unchanged, {len(report.failed)} failed)")
+        return report
+
     except Exception as e:
         logger.error(f"Error downloading project: {e}")
+        report.record(None, str(e))
+        return report
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+def _get_all(db, refs):
+    return list(db.get_all(refs))
+
+def _prefetch_documents(db, image_ids, report, chunk_size=GET_ALL_CHUNK_SIZE):
+    """
+    Resolve image documents with one get_all call per chunk in a background thread
+
+    IDs without a document, or whose chunk could not be read, are recorded as
+    failed in report as soon as their chunk returns, ahead of the downloads.
+
+    At most two chunks are read ahead of the downloads, and the thread stops
+    once the generator is closed. An unexpected error in the thread is raised
+    again by the generator.
+
+    Returns:
+        generator: (image_id, document data) pairs of the documents found, in
+            order, available as soon as their chunk has been read
+    """
+    results = queue.Queue(maxsize=chunk_size * 2)
+    stopped = threading.Event()
+    done = object()
+    errors = []
+
+    def put(item):
+        # Give up once the consumer has gone away instead of blocking forever
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
         return False
 
-def download_images_by_ids(image_ids, output_dir):
+    def resolve_chunks():
+        collection = db.collection('images')
+        for start in range(0, len(image_ids), chunk_size):
+            if stopped.is_set():
+                return
+            refs = []
+            chunk = []
+            for image_id in image_ids[start:start + chunk_size]:
+                try:
+                    refs.append(collection.document(image_id))
+                    chunk.append(image_id)
+                except Exception as e:
+                    # document() rejects malformed IDs such as "a/b"
+                    logger.error(f"Invalid image ID {image_id}: {e}")
+                    report.record(image_id, f"Invalid image ID {image_id}: {e}")
+            if not chunk:
+                continue
+            try:
+                snapshots = firestore_scheduler.call(
+                    _get_all, db, refs, cost=len(refs), operation='firestore.document.get_all')
+                found = {snapshot.id: snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+            except Exception as e:
+                logger.error(f"Error fetching {len(chunk)} image documents: {e}")
+                for image_id in chunk:
+                    report.record(image_id, f"Could not fetch image document: {e}")
+                continue
+            missing = [image_id for image_id in chunk if image_id not in found]
+            if missing:
+                logger.error(f"Images not found: {', '.join(missing)}")
+                for image_id in missing:
+                    report.record(image_id, f"Image with ID {image_id} not found")
+            for image_id in chunk:
+                if image_id in found and not put((image_id, found[image_id])):
+                    return
+
+    def resolve():
+        # done is always queued, so the consumer never waits on a dead thread
+        try:
+            resolve_chunks()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(done)
+
+    threading.Thread(target=resolve, daemon=True).start()
     try:
-        success = True
-        for image_id in image_ids:
-            if not download_image_and_metadata(image_id, output_dir):
-                success = False
-                logger.error(f"Failed to download image {image_id}")
-        return success
+        while True:
+            item = results.get()
+            if item is done:
+                if errors:
+                    raise errors[0]
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def download_images_by_ids(image_ids, output_dir, max_workers=1, variant=VARIANT_ORIGINAL):
+    """
+    Download multiple images and their metadata by ID
+
+    The documents are read in chunks of GET_ALL_CHUNK_SIZE with one get_all call
+    each, ahead of the downloads, which start as soon as the first chunk arrives.
+    IDs without a document are logged and reported as failed as their chunk
+    returns. Repeated IDs are downloaded once.
+
+    Args:
+        image_ids (list): IDs of the images to download
+        output_dir (str): Directory to download into
+        max_workers (int): Number of images downloaded concurrently
+        variant (str): VARIANT_ORIGINAL or VARIANT_THUMBNAIL
+
+    Returns:
+        DownloadReport: Counts and per-image failures; truthy if all images succeeded
+    """
+    report = DownloadReport()
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        image_ids = list(dict.fromkeys(str(image_id) for image_id in image_ids))
+        documents = _prefetch_documents(get_firestore_client(), image_ids, report)
+        jobs = (
+            (image_id, lambda image_id=image_id, image_data=image_data:
+                _download_document(image_id, image_data, output_dir, variant=variant))
+            for image_id, image_data in documents
+        )
+        _run_downloads(jobs, report, max_workers)
+        return report
     except Exception as e:
         logger.error(f"Error downloading images by IDs: {e}")
-        return False
+        report.record(None, str(e))
+        return report
 
 if __name__ == "__main__":
     output_directory = "./downloads"
@@ -159,10 +631,17 @@ if __name__ == "__main__":
             
             # Example: Download all images from a project
             download_project_images("Claving", output_directory, limit=10)
+
+            # Example: Download a whole project with 8 concurrent workers
+            # report = download_project_images("Claving", output_directory, max_workers=8)
+            # print(report.to_dict())
+
+            # Example: Fetch only new or changed images since the last run
+            # download_project_images("Claving", output_directory, max_workers=8, incremental=True)
             
             # Example: Download multiple images by IDs
             # image_ids = ["123", "124", "125"]
-            # download_images_by_ids(image_ids, output_directory)
+            # download_images_by_ids(image_ids, output_directory, max_workers=8)
             
             pass
         except Exception as e:
@@ -1,20 +1,13 @@
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import os
+import sys
 
-# Get credential paths from environment variables
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
-
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clients import get_drive_service, DRIVE_FULL_SCOPES
 
 def list_all_files():
     """Retrieve all files and folders from Google Drive."""
     query = "trashed = false"
-    results = drive_service.files().list(
+    results = get_drive_service(DRIVE_FULL_SCOPES).files().list(
         q=query, fields="files(id, name, mimeType)").execute()
     return results.get('files', [])
 
@@ -25,6 +18,7 @@ def delete_all_files():
         print("No files found in Google Drive.")
         return
     
+    drive_service = get_drive_service(DRIVE_FULL_SCOPES)
     for file in files:
         try:
             drive_service.files().delete(fileId=file['id']).execute()
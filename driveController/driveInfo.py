@@ -1,9 +1,23 @@
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import os
+import sys
+import json
+import time
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clients import get_drive_service
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Largest page Drive returns for files().list
+PAGE_SIZE = 1000
+
+# Where collected stats are cached, and for how many seconds they stay fresh
+STATS_CACHE_PATH = os.getenv(
+    "DRIVE_STATS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "drive_stats.json"))
+STATS_CACHE_TTL = 600
+
 def initialize_drive_service():
     """Initialize and return the Google Drive service."""
     try:
@@ -18,10 +32,7 @@ def initialize_drive_service():
             'https://www.googleapis.com/auth/drive.metadata.readonly'
         ]
 
-        # Create credentials and build service
-        credentials = service_account.Credentials.from_service_account_file(
-            drive_cred_path, scopes=SCOPES)
-        return build('drive', 'v3', credentials=credentials)
+        return get_drive_service(SCOPES)
     except Exception as e:
         print(f"Error initializing Drive service: {str(e)}")
         return None
@@ -34,8 +45,62 @@ def format_bytes(size):
         size /= 1024.0
     return f"{size:.2f} PB"
 
-def get_drive_info():
-    """Get basic information about the Google Drive account."""
+def collect_file_stats(service):
+    """Page through every file once and aggregate counts and bytes per MIME type."""
+    stats = {'files': 0, 'folders': 0, 'bytes': 0, 'by_mime_type': {}}
+    page_token = None
+    while True:
+        results = service.files().list(
+            q="trashed = false",
+            pageSize=PAGE_SIZE,
+            pageToken=page_token,
+            fields="nextPageToken, files(id, mimeType, size)"
+        ).execute()
+        for file in results.get('files', []):
+            mime_type = file.get('mimeType', 'unknown')
+            size = int(file.get('size', 0))
+            if mime_type == FOLDER_MIME_TYPE:
+                stats['folders'] += 1
+            else:
+                stats['files'] += 1
+            stats['bytes'] += size
+            entry = stats['by_mime_type'].setdefault(mime_type, {'count': 0, 'bytes': 0})
+            entry['count'] += 1
+            entry['bytes'] += size
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return stats
+
+def load_cached_info(max_age=STATS_CACHE_TTL):
+    """Return cached Drive information if it is younger than max_age seconds."""
+    try:
+        with open(STATS_CACHE_PATH, 'r') as f:
+            info = json.load(f)
+        if time.time() - info['collected_at'] <= max_age:
+            return info
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_cached_info(info):
+    try:
+        os.makedirs(os.path.dirname(STATS_CACHE_PATH), exist_ok=True)
+        with open(STATS_CACHE_PATH, 'w') as f:
+            json.dump(info, f)
+    except OSError as e:
+        print(f"Warning: Could not write Drive stats cache: {e}")
+
+def get_drive_info(refresh=False, max_age=STATS_CACHE_TTL):
+    """Get basic information about the Google Drive account.
+
+    Results are cached on disk with a timestamp; a cached result younger than
+    max_age seconds is returned without calling the API unless refresh is True.
+    """
+    if not refresh:
+        cached = load_cached_info(max_age)
+        if cached:
+            return cached
+
     try:
         # Initialize the service
         service = initialize_drive_service()
@@ -58,24 +123,10 @@ def get_drive_info():
         # Extract user information
         user = about.get('user', {})
         
-        # Get basic file count
-        files = service.files().list(
-            fields="files(id, mimeType)",
-            pageSize=1000
-        ).execute()
-        
-        file_count = len(files.get('files', []))
-        
-        # Get basic folder count
-        folders = service.files().list(
-            q="mimeType='application/vnd.google-apps.folder'",
-            fields="files(id)",
-            pageSize=1000
-        ).execute()
-        
-        folder_count = len(folders.get('files', []))
+        # Count files, folders and bytes in a single pass over every page
+        stats = collect_file_stats(service)
 
-        return {
+        info = {
             'storage': {
                 'total': format_bytes(total),
                 'used': format_bytes(used),
@@ -89,12 +140,17 @@ def get_drive_info():
                 'display_name': user.get('displayName', 'N/A')
             },
             'files': {
-                'total': file_count
+                'total': stats['files'],
+                'bytes': stats['bytes']
             },
             'folders': {
-                'total': folder_count
-            }
+                'total': stats['folders']
+            },
+            'by_mime_type': stats['by_mime_type'],
+            'collected_at': time.time()
         }
+        save_cached_info(info)
+        return info
 
     except HttpError as error:
         if error.resp.status == 403:
@@ -108,13 +164,14 @@ def get_drive_info():
         print(f"Unexpected error: {str(e)}")
         return None
 
-def display_drive_info():
+def display_drive_info(refresh=False):
     """Display formatted Drive information."""
-    info = get_drive_info()
+    info = get_drive_info(refresh=refresh)
     if not info:
         return
-    print(get_drive_info()) 
     print("\n=== Google Drive Account Information ===\n")
+    collected_at = datetime.fromtimestamp(info['collected_at']).strftime('%Y-%m-%d %H:%M:%S')
+    print(f"Collected at: {collected_at}\n")
     
     # Storage Information
     print("Storage Information:")
@@ -131,12 +188,18 @@ def display_drive_info():
     
     # File and Folder Counts
     print("\nFile and Folder Counts:")
-    print(f"Total Files: {info['files']['total']}")
+    print(f"Total Files: {info['files']['total']} ({format_bytes(info['files']['bytes'])})")
     print(f"Total Folders: {info['folders']['total']}")
 
+    # Breakdown by MIME type, largest first
+    print("\nFiles by Type:")
+    by_size = sorted(info['by_mime_type'].items(), key=lambda item: item[1]['bytes'], reverse=True)
+    for mime_type, entry in by_size:
+        print(f"{mime_type}: {entry['count']} files, {format_bytes(entry['bytes'])}")
+
 def main():
     try:
-        display_drive_info()
+        display_drive_info(refresh="--refresh" in sys.argv)
     except Exception as e:
         print(f"Fatal error: {str(e)}")
 
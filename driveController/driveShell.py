@@ -1,17 +1,17 @@
 
 import os
+import sys
 import readline
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 
-# Get credential paths from environment variables
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clients import get_drive_service as _get_shared_drive_service, DRIVE_FULL_SCOPES
+from folder_resolver import FolderResolver
 
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
+def get_drive_service():
+    """Return the Drive service with full Drive access, created on first use."""
+    return _get_shared_drive_service(DRIVE_FULL_SCOPES)
+
+folder_resolver = FolderResolver(get_drive_service, cache_path=os.getenv("DRIVE_FOLDER_CACHE"))
 
 # Store current directory (root by default)
 current_folder_id = "root"
@@ -19,7 +19,7 @@ current_folder_id = "root"
 def list_files(folder_id):
     """List all files and folders in the current Google Drive directory."""
     query = f"'{folder_id}' in parents and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name, mimeType)").execute()
+    results = get_drive_service().files().list(q=query, fields="files(id, name, mimeType)").execute()
     files = results.get('files', [])
     
     if not files:
@@ -30,14 +30,12 @@ def list_files(folder_id):
             print(f"{file_type} {file['name']} ({file['id']})")
 
 def change_directory(folder_name):
-    """Change current directory by folder name."""
+    """Change current directory by folder name or path (e.g. images/heat)."""
     global current_folder_id
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-    folders = results.get('files', [])
+    folder_id = folder_resolver.resolve(folder_name)
     
-    if folders:
-        current_folder_id = folders[0]['id']
+    if folder_id:
+        current_folder_id = folder_id
         print(f"Changed directory to {folder_name}")
     else:
         print(f"Folder '{folder_name}' not found")
@@ -49,18 +47,20 @@ def create_folder(folder_name):
         'mimeType': 'application/vnd.google-apps.folder',
         'parents': [current_folder_id]
     }
-    folder = drive_service.files().create(body=folder_metadata, fields='id').execute()
+    folder = get_drive_service().files().create(body=folder_metadata, fields='id').execute()
+    folder_resolver.remember(folder_name, folder['id'], current_folder_id)
     print(f"Created folder: {folder_name} ({folder['id']})")
 
 def delete_file(file_name):
     """Delete a file or folder by name in the current directory."""
     query = f"name='{file_name}' and '{current_folder_id}' in parents and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
+    results = get_drive_service().files().list(q=query, fields="files(id, name)").execute()
     files = results.get('files', [])
     
     if files:
         for file in files:
-            drive_service.files().delete(fileId=file['id']).execute()
+            get_drive_service().files().delete(fileId=file['id']).execute()
+            folder_resolver.forget(file['id'])
             print(f"Deleted: {file_name} ({file['id']})")
     else:
         print(f"File or folder '{file_name}' not found")
@@ -89,7 +89,7 @@ def drive_shell():
         elif command == "help":
             print("Available commands:")
             print("  ls       - List files in current directory")
-            print("  cd <dir> - Change directory")
+            print("  cd <dir> - Change directory (accepts paths such as images/heat)")
             print("  mkdir <dir> - Create a new folder")
             print("  rm <file/folder> - Delete a file or folder")
             print("  exit     - Exit the shell")
@@ -1,45 +1,84 @@
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import os
+import sys
 
-# Get credential path from environment variables
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from clients import get_drive_service as _get_shared_drive_service, DRIVE_FULL_SCOPES
 
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Largest page Drive returns for files().list, and only the fields build_tree needs
+PAGE_SIZE = 1000
+FILE_FIELDS = "id, name, mimeType, parents"
+
+def get_drive_service():
+    """Return the calling thread's Drive service with full Drive access."""
+    return _get_shared_drive_service(DRIVE_FULL_SCOPES)
+
+def iter_drive_files(query="trashed = false"):
+    """Yield every file matching query, following nextPageToken page by page."""
+    service = get_drive_service()
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query,
+            pageSize=PAGE_SIZE,
+            pageToken=page_token,
+            fields=f"nextPageToken, files({FILE_FIELDS})"
+        ).execute()
+        yield from results.get('files', [])
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+def _list_folder(folder_id):
+    return list(iter_drive_files(f"'{folder_id}' in parents and trashed = false"))
+
+def iter_drive_tree(root_id='root', max_workers=8):
+    """
+    Yield every file below root_id, listing folders concurrently in breadth-first order
+
+    Each folder is listed by a worker thread; its files are yielded as soon as that
+    folder's listing completes and its sub-folders are queued for listing.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_list_folder, root_id)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for file in future.result():
+                    if file['mimeType'] == FOLDER_MIME_TYPE:
+                        pending.add(executor.submit(_list_folder, file['id']))
+                    yield file
 
 def get_drive_files():
     """Retrieve all files and folders from Google Drive."""
-    query = "trashed = false"
-    results = drive_service.files().list(
-        q=query, fields="files(id, name, mimeType, parents)").execute()
-    return results.get('files', [])
+    return list(iter_drive_files())
 
 def build_tree(files):
-    """Build a hierarchical tree structure from the file list."""
-    tree = {}
+    """Build a hierarchical tree structure from a list or stream of files.
+
+    Files may arrive in any order; children seen before their parent are attached
+    when the parent arrives.
+    """
     lookup = {}
+    parent_of = {}
     
-    # Initialize dictionary with file metadata
-    for file in files:
-        lookup[file['id']] = {
-            'name': file['name'],
-            'type': 'folder' if file['mimeType'] == 'application/vnd.google-apps.folder' else 'file',
-            'children': []
-        }
-    
-    # Organize files into a hierarchy
     for file in files:
+        node = lookup.setdefault(file['id'], {'children': []})
+        node['name'] = file['name']
+        node['type'] = 'folder' if file['mimeType'] == FOLDER_MIME_TYPE else 'file'
+        
         parent_id = file.get('parents', ['root'])[0]  # Default to root if no parent
-        if parent_id in lookup:
-            lookup[parent_id]['children'].append(lookup[file['id']])
-        else:
-            tree[file['id']] = lookup[file['id']]  # Root-level items
+        parent_of[file['id']] = parent_id
+        lookup.setdefault(parent_id, {'children': []})['children'].append(node)
     
-    return tree
+    # Items whose parent was never listed are root-level items
+    return {
+        file_id: lookup[file_id]
+        for file_id, parent_id in parent_of.items()
+        if parent_id not in parent_of
+    }
 
 def print_tree(node, indent=0):
     """Print the file structure as a tree."""
@@ -47,9 +86,13 @@ def print_tree(node, indent=0):
     for child in node['children']:
         print_tree(child, indent + 1)
 
-def display_drive_tree():
-    """Retrieve and display the Google Drive tree structure."""
-    files = get_drive_files()
+def display_drive_tree(concurrent=False):
+    """Retrieve and display the Google Drive tree structure.
+
+    With concurrent=True only the tree below My Drive's root is walked, one
+    folder per worker; otherwise every visible file is listed page by page.
+    """
+    files = iter_drive_tree() if concurrent else iter_drive_files()
     tree = build_tree(files)
     
     print("Google Drive File Structure:")
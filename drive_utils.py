@@ -1,59 +1,221 @@
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
-from firebase_admin import firestore
+import mimetypes
 import os
+import threading
+from clients import get_drive_service
+from rate_limiter import drive_scheduler, firestore_scheduler
+from metrics import metrics
+from folder_resolver import FolderResolver
+from upload_journal import UploadJournal
 
-# Get credential path from environment variable
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
+# How uploaded files are made public: a permission per file, inherited from a
+# publicly shared parent folder, or per-file permissions sent in batch requests
+SHARING_PER_FILE = 'per_file'
+SHARING_INHERIT = 'inherit'
+SHARING_BATCH = 'batch'
 
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
+# Drive accepts at most 100 calls per batch request
+DRIVE_BATCH_SIZE = 100
 
-def check_folder_exists(folder_name):
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-    folders = results.get('files', [])
-    
-    if folders:
-        return folders[0]['id']
-    else:
-        return None
+# Bytes sent per resumable upload request; Drive requires a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
 
-def upload_image_to_drive(image_path, destination_name):
-    try:
-        # Get the images folder ID
-        images_folder_id = check_folder_exists("images")
-            
-        # Prepare the file metadata
-        file_metadata = {
-            'name': destination_name,
-            'parents': [images_folder_id]  # Use the images folder ID
-        }
-        
-        # Prepare the media file
-        media = MediaFileUpload(
-            image_path,
-            mimetype='image/jpeg' if image_path.lower().endswith('.jpg') else 'image/png',
-            resumable=True
-        )
-        
-        # Upload the file
-        file = drive_service.files().create(
-            body=file_metadata,
+# Documents fetched per query by iter_images, and Firestore's limit on the values
+# of an array_contains_any filter
+LIST_PAGE_SIZE = 500
+MAX_ARRAY_CONTAINS_ANY = 30
+
+_shared_folders = set()
+_shared_folders_lock = threading.Lock()
+
+# Optional local mirror (image_index.ImageIndex) consulted by get_image and list_images
+image_index = None
+
+def use_image_index(index):
+    """Serve get_image and list_images from a local ImageIndex, or pass None to stop."""
+    global image_index
+    image_index = index
+
+# Shared folder lookup cache; set DRIVE_FOLDER_CACHE to persist it between runs
+folder_resolver = FolderResolver(get_drive_service, cache_path=os.getenv("DRIVE_FOLDER_CACHE"))
+
+def check_folder_exists(folder_name, refresh=False):
+    """Return the ID of a folder path such as "images/heat", or None if it does not exist."""
+    return folder_resolver.resolve(folder_name, refresh=refresh)
+
+# Unfinished resumable uploads; set DRIVE_UPLOAD_JOURNAL to choose where it is kept
+upload_journal = UploadJournal()
+
+def create_drive_file(image_path, destination_name, folder_id, chunk_size=None, image_id=None):
+    """
+    Upload a file into a Drive folder and return its 'id' and 'webViewLink'
+
+    The file is sent chunk by chunk. While it is in progress, the session URI,
+    committed offset, destination name and image ID are kept in upload_journal, so
+    after a crash the same file continues from the last byte Drive committed
+    instead of starting over. A resumed upload keeps the destination name it was
+    started with; use upload_journal.lookup to reuse its image ID.
+
+    Args:
+        image_path (str): Path to the file
+        destination_name (str): Name to save the file as in Drive
+        folder_id (str): ID of the Drive folder to upload into
+        chunk_size (int, optional): Bytes per request, a multiple of 256 KiB;
+            defaults to UPLOAD_CHUNK_SIZE
+        image_id (int, optional): ID of the image document the file belongs to
+    """
+    # Prepare the media file
+    media = MediaFileUpload(
+        image_path,
+        mimetype=mimetypes.guess_type(image_path)[0] or 'application/octet-stream',
+        chunksize=chunk_size or UPLOAD_CHUNK_SIZE,
+        resumable=True
+    )
+
+    key = upload_journal.key(image_path, folder_id)
+    entry = upload_journal.get(key)
+    if entry is not None:
+        destination_name = entry['destination_name']
+        if image_id is None:
+            image_id = entry['image_id']
+
+    def new_request():
+        return get_drive_service().files().create(
+            body={'name': destination_name, 'parents': [folder_id]},
             media_body=media,
             fields='id, webViewLink'
-        ).execute()
+        )
+
+    request = new_request()
+    if entry is not None:
+        # Continue the journalled session from the recorded offset. If Drive has
+        # committed more than that, its 308 reply carries the committed range and
+        # next_chunk carries on from there
+        request.resumable_uri = entry['session_uri']
+        request.resumable_progress = entry['offset']
+        print(f"Resuming upload of {image_path} as {destination_name} from byte {entry['offset']}")
+
+    # Upload the file
+    response = None
+    while response is None:
+        offset = request.resumable_progress
+        try:
+            # Repeating a chunk, or the request that opens the session, cannot create a
+            # second file, so resumable uploads are retried on transient errors too
+            _, response = drive_scheduler.call(request.next_chunk, operation='drive.files.create')
+        except HttpError as e:
+            if entry is None or e.resp.status not in (404, 410):
+                raise
+            # The journalled session has expired; start a new one
+            print(f"Upload session for {image_path} expired, starting over")
+            upload_journal.remove(key)
+            entry = None
+            request = new_request()
+            continue
+        committed = media.size() if response is not None else request.resumable_progress
+        metrics.add_bytes('drive.files.create', sent=committed - offset)
+        if response is None:
+            upload_journal.record(key, image_path, folder_id, request.resumable_uri,
+                                  request.resumable_progress, destination_name, image_id)
+
+    upload_journal.remove(key)
+    return response
+
+def share_file_publicly(file_id):
+    """Grant read access on a Drive file to anyone with the link."""
+    get_drive_service().permissions().create(
+        fileId=file_id,
+        body={'type': 'anyone', 'role': 'reader'},
+        fields='id'
+    ).execute()
+
+def ensure_folder_shared(folder_id):
+    """Share a folder publicly once per process so files created in it inherit read access."""
+    with _shared_folders_lock:
+        if folder_id in _shared_folders:
+            return
+    share_file_publicly(folder_id)
+    with _shared_folders_lock:
+        _shared_folders.add(folder_id)
+
+class PermissionBatcher:
+    """
+    Coalesce public-read permission grants into Drive batch requests
+
+    Grants are sent once 100 are queued and on flush(). Each grant's callback is
+    called with None on success or the error once its batch has executed.
+    """
+
+    def __init__(self, batch_size=DRIVE_BATCH_SIZE):
+        self.batch_size = min(batch_size, DRIVE_BATCH_SIZE)
+        self._pending = []  # (file_id, callback) tuples
+        self._lock = threading.Lock()
+
+    def add(self, file_id, callback=None):
+        with self._lock:
+            self._pending.append((file_id, callback))
+            if len(self._pending) < self.batch_size:
+                return
+            pending, self._pending = self._pending, []
+        self._execute(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self._execute(pending)
+
+    def _execute(self, pending):
+        service = get_drive_service()
+        requests = [
+            (str(index), service.permissions().create(
+                fileId=file_id,
+                body={'type': 'anyone', 'role': 'reader'},
+                fields='id'
+            ))
+            for index, (file_id, _) in enumerate(pending)
+        ]
+        try:
+            results = drive_scheduler.execute_batch(service.new_batch_http_request, requests)
+            errors = {request_id: exception for request_id, (_, exception) in results.items()}
+        except Exception as e:
+            errors = {str(index): e for index in range(len(pending))}
+
+        for index, (file_id, callback) in enumerate(pending):
+            error = errors.get(str(index))
+            if error is not None:
+                print(f"Error sharing Drive file {file_id}: {error}")
+            if callback:
+                callback(error)
+
+def upload_image_to_drive(image_path, destination_name, sharing=SHARING_PER_FILE, image_id=None):
+    """
+    Upload an image to the Drive images folder and make it publicly readable
+    
+    Args:
+        image_path (str): Path to the image file
+        destination_name (str): Name to save the file as in Drive
+        sharing (str): SHARING_PER_FILE grants a permission on the new file;
+            SHARING_INHERIT shares the images folder once and relies on inheritance.
+            A single upload has nothing to batch, so SHARING_BATCH acts as SHARING_PER_FILE
+        image_id (int, optional): ID of the image document, kept in the upload journal
         
+    Returns:
+        dict: Contains 'file_id' and 'url' if successful, None otherwise
+    """
+    try:
+        # Get the images folder ID
+        images_folder_id = check_folder_exists("images")
+
+        if sharing == SHARING_INHERIT:
+            ensure_folder_shared(images_folder_id)
+
+        file = create_drive_file(image_path, destination_name, images_folder_id, image_id=image_id)
+
         # Make the file publicly accessible
-        drive_service.permissions().create(
-            fileId=file['id'],
-            body={'type': 'anyone', 'role': 'reader'},
-            fields='id'
-        ).execute()
+        if sharing != SHARING_INHERIT:
+            share_file_publicly(file['id'])
         
         print(f"Uploaded {image_path} to Google Drive")
         print(f"File ID: {file['id']}")
@@ -68,12 +230,20 @@ def upload_image_to_drive(image_path, destination_name):
         return None 
 
 def get_image(db, image_id):
+    if image_index is not None:
+        cached = image_index.get(image_id)
+        if cached is not None:
+            return cached
+
     try:
         doc_ref = db.collection('images').document(str(image_id))
-        doc = doc_ref.get()
+        doc = firestore_scheduler.call(doc_ref.get, operation='firestore.document.get')
         
         if doc.exists:
-            return doc.to_dict()
+            data = doc.to_dict()
+            if image_index is not None:
+                image_index.upsert([data])
+            return data
         else:
             print(f"Image with ID {image_id} not found")
             return None
@@ -81,14 +251,87 @@ def get_image(db, image_id):
         print(f"Error retrieving image document: {e}")
         return None
 
-def list_images(db, project_name=None, limit=10):
+def iter_images(db, project_name=None, label=None, labels=None, fields=None, page_size=LIST_PAGE_SIZE,
+                limit=None, order_by='created_at', descending=True, start_after=None):
+    """
+    Yield image documents page by page, resuming each page from the last document read
+
+    Only one page is held at a time, so a scan of a whole project runs in constant
+    memory. Filtering on a label and ordering by a field other than the filtered
+    ones needs a composite index in Firestore; the error message links to it.
+
+    Args:
+        db: Firestore database instance
+        project_name (str, optional): Only images of this project
+        label (optional): Only images whose 'label' array contains this label
+        labels (list, optional): Only images whose 'label' array contains any of
+            these labels, at most 30
+        fields (list, optional): Fields to fetch, e.g. ['id', 'drive_file_id'];
+            all fields by default. The order_by field is always fetched as the
+            cursor needs it
+        page_size (int): Documents per query
+        limit (int, optional): Stop after this many documents
+        order_by (str): Field the images are ordered by
+        descending (bool): Newest first when ordering by 'created_at'
+        start_after (optional): ID of the last image of a previous scan to continue after
+
+    Yields:
+        dict: Image document data, restricted to fields if given
+    """
+    if label is not None and labels is not None:
+        raise ValueError("Pass either label or labels, not both")
+    if labels is not None and not 0 < len(labels) <= MAX_ARRAY_CONTAINS_ANY:
+        raise ValueError(f"labels must hold between 1 and {MAX_ARRAY_CONTAINS_ANY} labels")
+
+    collection = db.collection('images')
+    query = collection
+    if project_name:
+        query = query.where('project', '==', project_name)
+    if label is not None:
+        query = query.where('label', 'array_contains', label)
+    elif labels is not None:
+        query = query.where('label', 'array_contains_any', list(labels))
+    if fields is not None:
+        fields = list(fields)
+        if order_by not in fields:
+            fields.append(order_by)
+        query = query.select(fields)
+    from firebase_admin import firestore
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    query = query.order_by(order_by, direction=direction)
+
+    cursor = None
+    if start_after is not None:
+        cursor = firestore_scheduler.call(
+            collection.document(str(start_after)).get, operation='firestore.document.get')
+        if not cursor.exists:
+            raise ValueError(f"Image with ID {start_after} not found")
+
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_limit = page_size if remaining is None else min(page_size, remaining)
+        page_query = query.start_after(cursor) if cursor is not None else query
+        count = 0
+        for doc in firestore_scheduler.stream(page_query.limit(page_limit).stream, operation='firestore.query.stream'):
+            count += 1
+            cursor = doc
+            yield doc.to_dict()
+        if remaining is not None:
+            remaining -= count
+        if count < page_limit:
+            return
+
+def list_images(db, project_name=None, limit=10, label=None, labels=None, fields=None):
+    if image_index is not None and labels is None and fields is None:
+        # Fewer than limit rows may only mean the index is missing some images,
+        # so only a full page is served from it
+        cached = image_index.list(project_name=project_name, label=label, limit=limit)
+        if len(cached) >= limit:
+            return cached
+
     try:
-        query = db.collection('images')
-        if project_name:
-            query = query.where('project', '==', project_name)
-        query = query.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
-        docs = query.stream()
-        return [doc.to_dict() for doc in docs]
+        return list(iter_images(db, project_name, label=label, labels=labels, fields=fields,
+                                page_size=limit, limit=limit))
     except Exception as e:
         print(f"Error listing images: {e}")
         return []
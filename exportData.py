@@ -0,0 +1,158 @@
+from drive_utils import convert_datetime
+from downloadData import get_drive_file_id, download_image_bytes
+from clients import get_firestore_client
+from rate_limiter import firestore_scheduler
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import io
+import os
+import json
+import time
+import tarfile
+from ccmd_logger import Logger
+
+logger = Logger('cows_detector')
+
+# A new shard is started once the current one reaches either limit
+DEFAULT_SHARD_BYTES = 1024 * 1024 * 1024
+DEFAULT_SHARD_SAMPLES = 10000
+
+INDEX_FILENAME = "index.json"
+
+def _add_member(tar, name, data):
+    """Append bytes to a tar archive and return the offset of the member's data."""
+    info = tarfile.TarInfo(name=name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+    # The data ends the member, padded to a whole number of 512-byte blocks
+    padded_size = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+    return tar.offset - padded_size
+
+def _fetch_sample(image_id, image_data):
+    """Download an image and serialise its metadata; return (image_id, image_data, bytes, json)."""
+    image_bytes = download_image_bytes(get_drive_file_id(image_data))
+    metadata = json.dumps(image_data, default=convert_datetime).encode('utf-8')
+    return image_id, image_data, image_bytes, metadata
+
+class ShardWriter:
+    """
+    Write samples sequentially into numbered tar shards, WebDataset style
+
+    Each sample is stored as "<key>.<ext>" for the image and "<key>.json" for its
+    metadata, so samples stay contiguous within a shard. Shards are written under a
+    temporary name and renamed once complete.
+    """
+
+    def __init__(self, output_dir, prefix, max_bytes=DEFAULT_SHARD_BYTES, max_samples=DEFAULT_SHARD_SAMPLES):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_samples = max_samples
+        self.shards = []  # {'name', 'samples', 'bytes'} per finished shard
+        self.samples = {}  # key -> [shard index, image offset, image size, metadata offset, metadata size]
+        self._tar = None
+        self._path = None
+        self._count = 0
+
+    def _open_shard(self):
+        name = f"{self.prefix}-{len(self.shards):06d}.tar"
+        self._path = os.path.join(self.output_dir, name)
+        self._tar = tarfile.open(f"{self._path}.tmp", 'w')
+        self._count = 0
+        self.shards.append({'name': name, 'samples': 0, 'bytes': 0})
+
+    def _close_shard(self):
+        self._tar.close()
+        os.replace(f"{self._path}.tmp", self._path)
+        self.shards[-1]['samples'] = self._count
+        self.shards[-1]['bytes'] = os.path.getsize(self._path)
+        self._tar = None
+
+    def write(self, key, extension, image_bytes, metadata):
+        if self._tar is None:
+            self._open_shard()
+        image_offset = _add_member(self._tar, f"{key}.{extension}", image_bytes)
+        metadata_offset = _add_member(self._tar, f"{key}.json", metadata)
+        self.samples[key] = [len(self.shards) - 1, image_offset, len(image_bytes), metadata_offset, len(metadata)]
+        self._count += 1
+        if self._count >= self.max_samples or self._tar.offset >= self.max_bytes:
+            self._close_shard()
+
+    def close(self):
+        if self._tar is not None:
+            self._close_shard()
+        index_path = os.path.join(self.output_dir, INDEX_FILENAME)
+        with open(index_path, 'w') as f:
+            json.dump({'shards': self.shards, 'samples': self.samples}, f, separators=(',', ':'))
+
+def export_project_shards(project_name, output_dir, max_workers=1, shard_bytes=DEFAULT_SHARD_BYTES,
+                          shard_samples=DEFAULT_SHARD_SAMPLES, limit=None):
+    """
+    Export a project's images and metadata as sequential tar shards
+
+    Images are downloaded into memory (concurrently with max_workers) and appended
+    to the current shard in ID order, so no per-image files are written. An
+    index.json next to the shards maps each sample key to its shard and to the
+    byte offsets and sizes of its image and metadata members.
+
+    Args:
+        project_name (str): Name of the project to export
+        output_dir (str): Directory for the shards; a sub-directory named after the
+            project is created
+        max_workers (int): Number of images downloaded concurrently
+        shard_bytes (int): Size at which a new shard is started
+        shard_samples (int): Number of samples at which a new shard is started
+        limit (int, optional): Maximum number of images to export
+
+    Returns:
+        dict: 'exported' count, 'shards' written and a 'failed' list of image IDs
+    """
+    project_dir = os.path.join(output_dir, project_name)
+    os.makedirs(project_dir, exist_ok=True)
+    writer = ShardWriter(project_dir, project_name, max_bytes=shard_bytes, max_samples=shard_samples)
+    failed = []
+    exported = 0
+
+    db = get_firestore_client()
+    from firebase_admin import firestore
+    query = db.collection('images').where('project', '==', project_name).order_by('id', direction=firestore.Query.ASCENDING)
+    if limit is not None:
+        query = query.limit(limit)
+
+    def write_sample(image_id, future):
+        nonlocal exported
+        try:
+            _, image_data, image_bytes, metadata = future.result()
+        except Exception as e:
+            logger.error(f"Failed to export image {image_id}: {e}")
+            failed.append(image_id)
+            return
+        extension = os.path.splitext(image_data.get('original_name', 'image.jpg'))[1].lstrip('.').lower() or 'jpg'
+        writer.write(str(image_id), extension, image_bytes, metadata)
+        exported += 1
+        if exported % 100 == 0:
+            logger.info(f"Exported {exported} images from project {project_name}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # Samples are written in query order; the window bounds how many are held in memory
+            window = deque()
+            for doc in firestore_scheduler.stream(query.stream, operation='firestore.query.stream'):
+                window.append((doc.id, executor.submit(_fetch_sample, doc.id, doc.to_dict())))
+                if len(window) >= max(1, max_workers) * 2:
+                    write_sample(*window.popleft())
+            while window:
+                write_sample(*window.popleft())
+    finally:
+        writer.close()
+
+    logger.info(f"Exported {exported} images from project {project_name} into {len(writer.shards)} shards ({len(failed)} failed)")
+    return {'exported': exported, 'shards': [shard['name'] for shard in writer.shards], 'failed': failed}
+
+if __name__ == "__main__":
+    try:
+        # Example: Export a project as 1 GB tar shards with 8 concurrent downloads
+        export_project_shards("Claving", "./exports", max_workers=8)
+    except Exception as e:
+        logger.error(f"Error during export: {e}")
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Seconds a resolved folder ID stays valid before Drive is queried again
+DEFAULT_TTL = 300
+
+class FolderResolver:
+    """
+    Resolve Drive folder paths such as "images/heat" to folder IDs
+
+    Lookups are cached per (parent, name) segment with a TTL, and the cache can be
+    persisted to a JSON file so short-lived scripts share it; the file is written at
+    most once per call, and only when the cache changed. Folders that are not
+    found are never cached.
+
+    Args:
+        service: Drive service, or a callable returning one (e.g. a per-thread getter)
+        ttl (float): Seconds a cached folder ID stays valid
+        cache_path (str, optional): JSON file used to persist the cache
+    """
+
+    def __init__(self, service, ttl=DEFAULT_TTL, cache_path=None):
+        self._service = service
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self._cache = {}  # (parent_id, name) -> (folder_id, expires_at)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+
+    def _get_service(self):
+        return self._service() if callable(self._service) else self._service
+
+    def _load(self):
+        # Caller must hold self._lock; the file is read on first use, not on construction
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                entries = json.load(f)
+            now = time.time()
+            for entry in entries:
+                if entry['expires_at'] > now:
+                    self._cache[(entry['parent_id'], entry['name'])] = (entry['folder_id'], entry['expires_at'])
+        except Exception as e:
+            print(f"Warning: Could not load folder cache from {self.cache_path}: {e}")
+
+    def _save(self):
+        # Caller must hold self._lock; nothing is written unless the cache changed
+        if not self._dirty or not self.cache_path:
+            self._dirty = False
+            return
+        self._dirty = False
+        entries = [
+            {'parent_id': parent_id, 'name': name, 'folder_id': folder_id, 'expires_at': expires_at}
+            for (parent_id, name), (folder_id, expires_at) in self._cache.items()
+        ]
+        try:
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"Warning: Could not save folder cache to {self.cache_path}: {e}")
+
+    def _lookup(self, name, parent_id):
+        """Query Drive for a folder by name, inside parent_id or anywhere if it is None."""
+        escaped = name.replace("\\", "\\\\").replace("'", "\\'")
+        query = f"name='{escaped}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+        if parent_id:
+            query += f" and '{parent_id}' in parents"
+        results = self._get_service().files().list(q=query, fields="files(id)", pageSize=1).execute()
+        folders = results.get('files', [])
+        return folders[0]['id'] if folders else None
+
+    def resolve(self, path, parent_id=None, refresh=False):
+        """
+        Resolve a slash-separated folder path to a folder ID
+
+        Args:
+            path (str): Folder path, e.g. "images" or "images/heat"
+            parent_id (str, optional): Folder the path is relative to. When omitted
+                the first segment is matched by name anywhere in the Drive
+            refresh (bool): Skip the cache and query Drive for every segment
+
+        Returns:
+            str: Folder ID if found, None otherwise
+        """
+        try:
+            return self._resolve(path, parent_id, refresh)
+        finally:
+            with self._lock:
+                self._save()
+
+    def _resolve(self, path, parent_id, refresh):
+        folder_id = parent_id
+        for name in (segment for segment in path.split('/') if segment):
+            key = (folder_id or '', name)
+            now = time.time()
+            with self._lock:
+                self._load()
+                cached = None if refresh else self._cache.get(key)
+            if cached and cached[1] > now:
+                folder_id = cached[0]
+                continue
+
+            found = self._lookup(name, folder_id)
+            with self._lock:
+                if found is None:
+                    if self._cache.pop(key, None) is not None:
+                        self._dirty = True
+                else:
+                    self._cache[key] = (found, now + self.ttl)
+                    self._dirty = True
+            if found is None:
+                return None
+            folder_id = found
+        return folder_id
+
+    def remember(self, name, folder_id, parent_id=None):
+        """Record a newly created folder and drop cached lookups it may shadow."""
+        with self._lock:
+            self._load()
+            for key in [key for key in self._cache if key[1] == name]:
+                del self._cache[key]
+            self._cache[(parent_id or '', name)] = (folder_id, time.time() + self.ttl)
+            self._dirty = True
+            self._save()
+
+    def forget(self, folder_id):
+        """Drop cache entries for a deleted folder and for anything resolved inside it."""
+        with self._lock:
+            self._load()
+            removed_ids = {folder_id}
+            stale = True
+            while stale:
+                stale = [
+                    key for key, (cached_id, _) in self._cache.items()
+                    if cached_id in removed_ids or key[0] in removed_ids
+                ]
+                for key in stale:
+                    removed_ids.add(self._cache.pop(key)[0])
+                    self._dirty = True
+            self._save()
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            self._loaded = True
+            self._cache.clear()
+            self._dirty = True
+            self._save()
@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from drive_utils import convert_datetime
+from rate_limiter import firestore_scheduler
+
+DEFAULT_INDEX_PATH = os.getenv("IMAGE_INDEX_PATH", "./image_index.sqlite3")
+
+# Documents written to SQLite per transaction during sync
+SYNC_BATCH_SIZE = 500
+
+# Version of the stored document format; an index in an older format is emptied
+# on open and filled again by the next sync. Version 2 keeps timestamps as datetimes
+FORMAT_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id TEXT PRIMARY KEY,
+    project TEXT,
+    created_at REAL,
+    updated_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_project ON images (project, created_at);
+CREATE INDEX IF NOT EXISTS idx_images_created_at ON images (created_at);
+CREATE TABLE IF NOT EXISTS image_labels (
+    image_id TEXT NOT NULL,
+    label TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_image_labels_label ON image_labels (label);
+CREATE INDEX IF NOT EXISTS idx_image_labels_image_id ON image_labels (image_id);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+def _to_epoch(value):
+    """Convert a Firestore timestamp to epoch seconds, or None if it is not one."""
+    if hasattr(value, 'timestamp'):
+        return value.timestamp()
+    return None
+
+def _latest(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+def _encode(value):
+    """JSON default for stored documents: tag timestamps so _decode rebuilds them."""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.rfc3339() if hasattr(value, 'rfc3339') else value.isoformat()}
+    return convert_datetime(value)
+
+def _decode(obj):
+    """JSON object_hook rebuilding the timestamps tagged by _encode, as Firestore returns them."""
+    if len(obj) != 1 or '__datetime__' not in obj:
+        return obj
+    from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+    try:
+        return DatetimeWithNanoseconds.from_rfc3339(obj['__datetime__'])
+    except ValueError:
+        return datetime.fromisoformat(obj['__datetime__'])
+
+def _label_key(label):
+    """Labels may be plain strings or annotation dicts; index both as JSON text."""
+    return json.dumps(label, sort_keys=True, default=convert_datetime)
+
+class ImageIndex:
+    """
+    Local SQLite mirror of the Firestore images collection
+
+    The mirror is keyed by image ID with indexes on project, label and created_at,
+    and is kept current by sync(), which only fetches documents whose updated_at
+    is newer than the last synced watermark. Returned documents have the same
+    shape as Firestore's, with timestamps as DatetimeWithNanoseconds. Deletions in
+    Firestore are not picked up by sync(); call remove() or rebuild the index
+    after deleting images.
+
+    Args:
+        path (str): SQLite database file, or ":memory:"
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = 'format'").fetchone()
+            if row is None or row[0] < FORMAT_VERSION:
+                # Older rows hold timestamps as plain strings; fetch everything again
+                self._conn.execute("DELETE FROM images")
+                self._conn.execute("DELETE FROM image_labels")
+                self._conn.execute("DELETE FROM sync_state")
+                self._conn.execute(
+                    "INSERT INTO sync_state (key, value) VALUES ('format', ?)", (FORMAT_VERSION,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @property
+    def watermark(self):
+        """Epoch seconds of the newest updated_at seen by sync(), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = 'updated_at'").fetchone()
+        return row[0] if row else None
+
+    def upsert(self, docs):
+        """
+        Insert or replace image documents
+
+        Args:
+            docs (iterable): Image document dicts, each with an 'id'
+
+        Returns:
+            float: Newest updated_at among the documents in epoch seconds, or None
+        """
+        newest = None
+        with self._lock, self._conn:
+            for doc in docs:
+                image_id = str(doc['id'])
+                updated_at = _to_epoch(doc.get('updated_at'))
+                if updated_at is not None and (newest is None or updated_at > newest):
+                    newest = updated_at
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO images (id, project, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)",
+                    (image_id, doc.get('project'), _to_epoch(doc.get('created_at')), updated_at,
+                     json.dumps(doc, default=_encode))
+                )
+                self._conn.execute("DELETE FROM image_labels WHERE image_id = ?", (image_id,))
+                self._conn.executemany(
+                    "INSERT INTO image_labels (image_id, label) VALUES (?, ?)",
+                    [(image_id, _label_key(label)) for label in doc.get('label') or []]
+                )
+        return newest
+
+    def remove(self, image_ids):
+        """Drop documents from the index, e.g. after deleting them from Firestore."""
+        with self._lock, self._conn:
+            for image_id in image_ids:
+                self._conn.execute("DELETE FROM images WHERE id = ?", (str(image_id),))
+                self._conn.execute("DELETE FROM image_labels WHERE image_id = ?", (str(image_id),))
+
+    def sync(self, db):
+        """
+        Fetch documents updated since the last sync and store them locally
+
+        Args:
+            db: Firestore database instance
+
+        Returns:
+            int: Number of documents fetched
+        """
+        query = db.collection('images')
+        watermark = self.watermark
+        if watermark is not None:
+            # The watermark is truncated to microseconds, so the boundary document
+            # may be fetched again; upserting it twice is harmless
+            since = datetime.fromtimestamp(watermark, tz=timezone.utc)
+            query = query.where('updated_at', '>', since)
+        from firebase_admin import firestore
+        query = query.order_by('updated_at', direction=firestore.Query.ASCENDING)
+
+        count = 0
+        newest = watermark
+        batch = []
+        for doc in firestore_scheduler.stream(query.stream, operation='firestore.query.stream'):
+            batch.append(doc.to_dict())
+            if len(batch) >= SYNC_BATCH_SIZE:
+                newest = _latest(newest, self.upsert(batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            newest = _latest(newest, self.upsert(batch))
+            count += len(batch)
+
+        if newest is not None:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('updated_at', ?)", (newest,))
+        print(f"Synced {count} image documents into {self.path}")
+        return count
+
+    def get(self, image_id):
+        """Return an image document from the index, or None if it is not indexed."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM images WHERE id = ?", (str(image_id),)).fetchone()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def list(self, project_name=None, label=None, limit=10):
+        """Return the most recently created indexed images, optionally filtered."""
+        sql = "SELECT data FROM images"
+        conditions = []
+        params = []
+        if project_name:
+            conditions.append("project = ?")
+            params.append(project_name)
+        if label is not None:
+            conditions.append("id IN (SELECT image_id FROM image_labels WHERE label = ?)")
+            params.append(_label_key(label))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row[0], object_hook=_decode) for row in rows]
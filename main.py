@@ -1,10 +1,9 @@
 # Firebase configuration
-import firebase_admin # type: ignore
-from firebase_admin import credentials, firestore
 import os
 from termcolor import colored, cprint
 from uploadData import process_images_from_uploadgate
 from drive_utils import check_folder_exists, upload_image_to_drive
+from clients import get_firestore_client
 from ccmd_logger import Logger
 
 logger = Logger('cows_detector')
@@ -12,15 +11,10 @@ logger = Logger('cows_detector')
 # Get credential path from environment variable
 firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS_JSON")
 
-logger.info(f"Using Firebase credentials from: {firebase_cred_path}")
-# Initialize Firebase Admin SDK
-firebase_cred = credentials.Certificate(firebase_cred_path)
-firebase_admin.initialize_app(firebase_cred)
-
 def check_firebase_connection():
     try:
         # Test database connection
-        db = firestore.client()
+        db = get_firestore_client()
         test_doc = db.collection('test').document('test')
         test_doc.set({'test': 'connection'})
         test_doc.delete()
@@ -37,7 +31,8 @@ def check_firebase_connection():
 
 def check_google_drive_connection():
     try:
-        images_folder_id = check_folder_exists("images")
+        # Bypass the folder cache so the check really reaches Drive
+        images_folder_id = check_folder_exists("images", refresh=True)
         if images_folder_id:
             logger.info("Successfully connected to Google Drive and verified images folder")
             return True
@@ -49,10 +44,11 @@ def check_google_drive_connection():
     return True
 
 if __name__ == "__main__":
+    logger.info(f"Using Firebase credentials from: {firebase_cred_path}")
     # Check connections
     if check_firebase_connection() and check_google_drive_connection():
         try:
-            db = firestore.client()
+            db = get_firestore_client()
             # Example: Upload new images
             # process_images_from_uploadgate(db, "heat", "./uploadGate")
         except Exception as e:
@@ -0,0 +1,308 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds of the latency histogram buckets; a final +Inf bucket
+# catches everything slower
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix of the exported Prometheus metric names
+PROMETHEUS_PREFIX = "cows_detector"
+
+class OperationStats:
+    """Counters and latency histogram of one operation, e.g. 'drive.files.create'."""
+
+    __slots__ = ('calls', 'errors', 'retries', 'items', 'bytes_sent', 'bytes_received',
+                 'latency_sum', 'latency_count', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.items = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.latency_sum += seconds
+        self.latency_count += 1
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, q):
+        """Estimate a latency quantile as the upper bound of the bucket it falls in."""
+        if not self.latency_count:
+            return None
+        rank = q * self.latency_count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'items': self.items,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency_seconds': {
+                'count': self.latency_count,
+                'sum': round(self.latency_sum, 6),
+                'mean': round(self.latency_sum / self.latency_count, 6) if self.latency_count else None,
+                'p50': self.quantile(0.50),
+                'p99': self.quantile(0.99),
+                'buckets': buckets,
+            },
+        }
+
+class _Timer:
+    __slots__ = ('_metrics', '_operation', '_started')
+
+    def __init__(self, metrics, operation):
+        self._metrics = metrics
+        self._operation = operation
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.record(self._operation, time.perf_counter() - self._started, error=exc_type is not None)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class Metrics:
+    """
+    Per-operation call counts, errors, retries, bytes and latency histograms
+
+    Operations are named after the API call, e.g. 'drive.files.create',
+    'drive.files.get_media', 'drive.permissions.create', 'firestore.document.get'
+    or 'firestore.query.stream'. Recording is a no-op while disabled, so the
+    instrumentation can stay in place on hot paths.
+
+    Args:
+        enabled (bool): Whether to record from the start
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._operations = {}
+            self._started = time.time()
+
+    def _stats(self, operation):
+        # Caller must hold self._lock
+        stats = self._operations.get(operation)
+        if stats is None:
+            stats = self._operations[operation] = OperationStats()
+        return stats
+
+    def record(self, operation, seconds=None, error=False, items=0, bytes_sent=0, bytes_received=0):
+        """
+        Record one call of an operation
+
+        Args:
+            operation (str): Operation name
+            seconds (float, optional): Latency of the call; None if it was not timed
+                on its own, e.g. a request sent inside a batch
+            error (bool): Whether the call failed
+            items (int): Documents or files the call returned
+            bytes_sent (int): Request body bytes
+            bytes_received (int): Response body bytes
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats(operation)
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            stats.items += items
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            if seconds is not None:
+                stats.observe(seconds)
+
+    def add_retry(self, operation):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._stats(operation).retries += 1
+
+    def add_bytes(self, operation, sent=0, received=0):
+        """Count bytes moved by an operation whose calls are recorded separately."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats(operation)
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+
+    def add_items(self, operation, count):
+        """Count documents or files returned by an operation whose calls are recorded separately."""
+        if not self.enabled or not count:
+            return
+        with self._lock:
+            self._stats(operation).items += count
+
+    def timed(self, operation):
+        """Return a context manager that records one call of operation with its latency."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, operation)
+
+    def iterate(self, operation, iterable):
+        """
+        Yield from iterable, e.g. a Firestore query stream, recording it as one call
+
+        Only the time spent waiting for the next item counts as latency, not the
+        time the caller spends on each item.
+        """
+        if not self.enabled:
+            return iterable
+        return self._iterate(operation, iterable)
+
+    def _iterate(self, operation, iterable):
+        iterator = iter(iterable)
+        items = 0
+        waited = 0.0
+        error = False
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    waited += time.perf_counter() - started
+                    return
+                except Exception:
+                    waited += time.perf_counter() - started
+                    error = True
+                    raise
+                waited += time.perf_counter() - started
+                items += 1
+                yield item
+        finally:
+            self.record(operation, waited, error=error, items=items)
+
+    def aiterate(self, operation, iterable):
+        """Async counterpart of iterate for async iterables such as async Firestore query streams."""
+        if not self.enabled:
+            return iterable
+        return self._aiterate(operation, iterable)
+
+    async def _aiterate(self, operation, iterable):
+        iterator = iterable.__aiter__()
+        items = 0
+        waited = 0.0
+        error = False
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    waited += time.perf_counter() - started
+                    return
+                except Exception:
+                    waited += time.perf_counter() - started
+                    error = True
+                    raise
+                waited += time.perf_counter() - started
+                items += 1
+                yield item
+        finally:
+            self.record(operation, waited, error=error, items=items)
+
+    def snapshot(self):
+        """
+        Return everything recorded so far
+
+        Returns:
+            dict: 'started_at' and 'collected_at' Unix timestamps and 'operations'
+                mapping each operation name to its counters and latency summary
+        """
+        with self._lock:
+            operations = {name: stats.to_dict() for name, stats in sorted(self._operations.items())}
+            started = self._started
+        return {'started_at': started, 'collected_at': time.time(), 'operations': operations}
+
+    def to_json(self, path=None):
+        """Return the snapshot as JSON, also writing it to path if given."""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            operations = sorted(self._operations.items())
+            lines = []
+            counters = (
+                ('calls_total', 'calls', "API calls, including failed attempts"),
+                ('errors_total', 'errors', "API calls that raised an error"),
+                ('retries_total', 'retries', "API calls retried after a throttled or transient error"),
+                ('items_total', 'items', "Documents or files returned"),
+                ('bytes_sent_total', 'bytes_sent', "Request body bytes sent"),
+                ('bytes_received_total', 'bytes_received', "Response body bytes received"),
+            )
+            for suffix, attribute, help_text in counters:
+                name = f"{PROMETHEUS_PREFIX}_api_{suffix}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for operation, stats in operations:
+                    lines.append(f'{name}{{operation="{operation}"}} {getattr(stats, attribute)}')
+
+            name = f"{PROMETHEUS_PREFIX}_api_request_duration_seconds"
+            lines.append(f"# HELP {name} Latency of API calls")
+            lines.append(f"# TYPE {name} histogram")
+            for operation, stats in operations:
+                if not stats.latency_count:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{operation="{operation}"}} {stats.latency_sum}')
+                lines.append(f'{name}_count{{operation="{operation}"}} {stats.latency_count}')
+        return "\n".join(lines) + "\n"
+
+# Shared metrics for all Drive and Firestore calls, off unless METRICS_ENABLED is set
+metrics = Metrics(enabled=os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes"))
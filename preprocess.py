@@ -0,0 +1,166 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+# Longest side in pixels after resizing, and JPEG quality used when re-encoding
+DEFAULT_MAX_SIDE = 2048
+DEFAULT_QUALITY = 85
+
+# Longest side in pixels and JPEG quality of thumbnails
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 80
+
+def _image_format(path):
+    return 'PNG' if path.lower().endswith('.png') else 'JPEG'
+
+def _stamp_path(dst_path):
+    return f"{dst_path}.params.json"
+
+def _read_stamp(dst_path):
+    try:
+        with open(_stamp_path(dst_path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def preprocess_image(src_path, dst_path, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY):
+    """
+    Resize and re-encode one image without its EXIF metadata
+
+    The EXIF orientation is applied to the pixels before the metadata is dropped,
+    and images are only ever scaled down. JPEG files are re-encoded at quality,
+    PNG files stay lossless. The settings are stamped next to the output in
+    dst_path + ".params.json". If dst_path is already newer than src_path and was
+    made with the same max_side and quality it is kept as it is, so an interrupted
+    upload can resume on the same file.
+
+    Args:
+        src_path (str): Original image
+        dst_path (str): Where to write the processed image, in the same format
+        max_side (int): Largest width or height in pixels
+        quality (int): JPEG quality from 1 to 95
+
+    Returns:
+        dict: 'width', 'height' and 'size_bytes' of the processed image
+    """
+    params = {'max_side': max_side, 'quality': quality}
+    if (os.path.exists(dst_path) and os.path.getmtime(dst_path) >= os.path.getmtime(src_path)
+            and _read_stamp(dst_path) == params):
+        with Image.open(dst_path) as image:
+            width, height = image.size
+        return {'width': width, 'height': height, 'size_bytes': os.path.getsize(dst_path)}
+
+    image_format = _image_format(src_path)
+    with Image.open(src_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            options = {'quality': quality, 'optimize': True}
+        else:
+            options = {'optimize': True}
+        width, height = image.size
+        # Write under a temporary name so a crash never leaves a truncated image
+        # that looks newer than its source
+        tmp_path = f"{dst_path}.tmp"
+        image.save(tmp_path, image_format, **options)
+    os.replace(tmp_path, dst_path)
+    # Stamped only once the image is in place, so a crash never vouches for an old one
+    with open(_stamp_path(dst_path), 'w') as f:
+        json.dump(params, f)
+    return {'width': width, 'height': height, 'size_bytes': os.path.getsize(dst_path)}
+
+def thumbnail_name(image_file):
+    """
+    Return the file name of an image's thumbnail; thumbnails are always JPEG
+
+    The source extension is kept, so x.jpg and x.png get different thumbnails.
+    """
+    return f"{image_file}_thumb.jpg"
+
+def make_thumbnail(src_path, dst_path, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    """
+    Write a JPEG thumbnail whose longest side is at most size pixels
+
+    Returns:
+        dict: 'width', 'height' and 'size_bytes' of the thumbnail
+    """
+    with Image.open(src_path) as original:
+        # draft() lets the JPEG decoder skip most of the full-resolution pixels
+        original.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((size, size), Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        width, height = image.size
+        tmp_path = f"{dst_path}.tmp"
+        image.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+    os.replace(tmp_path, dst_path)
+    return {'width': width, 'height': height, 'size_bytes': os.path.getsize(dst_path)}
+
+def _process_files(func, images_dir, image_files, output_dir, output_name, *args, max_workers=None):
+    """Run func(src_path, dst_path, *args) for each file in a process pool."""
+    os.makedirs(output_dir, exist_ok=True)
+    processed = {}
+    failed = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                func,
+                os.path.join(images_dir, image_file),
+                os.path.join(output_dir, output_name(image_file)),
+                *args
+            ): image_file
+            for image_file in image_files
+        }
+        for future, image_file in futures.items():
+            try:
+                processed[image_file] = future.result()
+            except Exception as e:
+                failed[image_file] = str(e)
+    return processed, failed
+
+def make_thumbnails(images_dir, image_files, output_dir, size=THUMBNAIL_SIZE, max_workers=None):
+    """
+    Write a thumbnail of each image to output_dir in a process pool
+
+    Args:
+        images_dir (str): Directory containing the images
+        image_files (list): File names to make thumbnails of
+        output_dir (str): Directory the thumbnails are written to, named by thumbnail_name
+        size (int): Longest side of a thumbnail in pixels
+        max_workers (int, optional): Worker processes, one per CPU by default
+
+    Returns:
+        tuple: (dict mapping each image file name to its thumbnail's 'width', 'height'
+            and 'size_bytes', dict mapping each file that failed to the error message)
+    """
+    return _process_files(make_thumbnail, images_dir, image_files, output_dir, thumbnail_name,
+                          size, max_workers=max_workers)
+
+def preprocess_images(images_dir, image_files, output_dir, max_side=DEFAULT_MAX_SIDE,
+                      quality=DEFAULT_QUALITY, max_workers=None):
+    """
+    Preprocess image files in a process pool, one process per CPU by default
+
+    Args:
+        images_dir (str): Directory containing the original files
+        image_files (list): File names to process
+        output_dir (str): Directory the processed files are written to, under the same names
+        max_side (int): Largest width or height in pixels
+        quality (int): JPEG quality from 1 to 95
+        max_workers (int, optional): Worker processes
+
+    Returns:
+        tuple: (dict mapping each processed file name to its 'width', 'height' and
+            'size_bytes', dict mapping each file that failed to the error message)
+    """
+    processed, failed = _process_files(preprocess_image, images_dir, image_files, output_dir,
+                                       os.path.basename, max_side, quality, max_workers=max_workers)
+
+    original_bytes = sum(os.path.getsize(os.path.join(images_dir, image_file)) for image_file in processed)
+    processed_bytes = sum(fields['size_bytes'] for fields in processed.values())
+    print(f"Preprocessed {len(processed)} images: {original_bytes} -> {processed_bytes} bytes")
+    return processed, failed
@@ -0,0 +1,476 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from metrics import metrics
+
+# Outcomes of a failed call as judged by classify_error
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+
+# HTTP statuses worth retrying, and the 403 reasons Drive uses for quota errors
+THROTTLED_STATUSES = {429}
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# HTTP methods that can be repeated without changing the result, and Drive
+# operations that are safe to repeat although they are POSTs: granting the same
+# permission again returns the existing permission
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE'}
+IDEMPOTENT_OPERATIONS = {'drive.permissions.create'}
+
+# Seconds after a concurrency decrease during which further throttling is ignored,
+# so one burst of rejected in-flight requests only halves the limit once
+DECREASE_COOLDOWN = 1.0
+
+def _http_error_reason(error):
+    """Return the first error reason of a googleapiclient HttpError, if any."""
+    try:
+        content = json.loads(error.content.decode('utf-8'))
+        return content['error']['errors'][0].get('reason')
+    except Exception:
+        return None
+
+def classify_error(error):
+    """
+    Decide whether a failed Drive or Firestore call should be retried
+
+    Args:
+        error (Exception): Exception raised by the call, or None
+
+    Returns:
+        str: THROTTLED for quota errors, TRANSIENT for server and network errors,
+            None if the call should not be retried
+    """
+    if error is None:
+        return None
+    # googleapiclient.errors.HttpError carries the response, aiohttp's
+    # ClientResponseError the status; google.api_core exceptions (Firestore) carry
+    # the HTTP status in 'code'
+    response = getattr(error, 'resp', None)
+    status = getattr(response, 'status', None)
+    if status is None and isinstance(getattr(error, 'status', None), int):
+        status = error.status
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    if status is not None:
+        status = int(status)
+        if status in THROTTLED_STATUSES:
+            return THROTTLED
+        if status == 403 and _http_error_reason(error) in RATE_LIMIT_REASONS:
+            return THROTTLED
+        if status in TRANSIENT_STATUSES:
+            return TRANSIENT
+        return None
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return THROTTLED
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout)):
+        return TRANSIENT
+    if any(cls.__name__ == 'ClientConnectionError' for cls in type(error).__mro__):
+        # aiohttp connection failures, e.g. ServerDisconnectedError
+        return TRANSIENT
+    return None
+
+class TokenBucket:
+    """
+    Token bucket refilled at a fixed rate
+
+    Args:
+        rate (float): Tokens added per second, i.e. the sustained request rate
+        capacity (float, optional): Largest burst; defaults to one second's worth
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens):
+        """Take tokens if available and return 0, or return the seconds to wait for them."""
+        # A request larger than the bucket would never fit, so it drains it instead
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available and take them."""
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """Wait in the event loop until tokens are available and take them."""
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+class AdaptiveConcurrency:
+    """
+    Limit on simultaneous calls that adapts to throttling
+
+    The limit is halved when a call is throttled and raised by one after a full
+    limit's worth of calls succeed in a row (additive increase, multiplicative
+    decrease), so it settles just below the point where the service pushes back.
+
+    Args:
+        max_limit (int): Highest number of simultaneous calls
+        min_limit (int): Lowest number the limit is reduced to
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self._in_flight = 0
+        self._successes = 0
+        self._decreased_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self._decrease()
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def throttled(self):
+        """Record throttling observed outside acquire()/release(), e.g. inside a batch."""
+        with self._cond:
+            self._decrease()
+
+    def _decrease(self):
+        # Caller must hold self._cond
+        now = time.monotonic()
+        self._successes = 0
+        if now - self._decreased_at < DECREASE_COOLDOWN:
+            return
+        self._decreased_at = now
+        self.limit = max(self.min_limit, self.limit / 2)
+
+class RequestScheduler:
+    """
+    Run API calls under a rate limit, an adaptive concurrency limit and retries
+
+    Every call first takes a token from the bucket, then a concurrency slot.
+    Throttled and transient failures are retried with exponential backoff and full
+    jitter; throttling also lowers the concurrency limit. A throttled request was
+    rejected before it took effect, but a transient failure such as a 5xx or a
+    timeout may follow a request that succeeded, so calls that are not idempotent
+    are only retried when throttled.
+
+    Args:
+        name (str): Service name used in log messages
+        rate (float): Sustained requests per second, sized to the quota
+        max_concurrency (int): Highest number of simultaneous calls
+        burst (float, optional): Largest burst of requests above the rate
+        max_retries (int): Retries per call before the error is raised
+        base_delay (float): Backoff ceiling in seconds for the first retry
+        max_delay (float): Largest backoff ceiling in seconds
+    """
+
+    def __init__(self, name, rate, max_concurrency, burst=None, max_retries=5, base_delay=1.0, max_delay=32.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, calls=0, retries=0, throttled=0):
+        with self._stats_lock:
+            self.calls += calls
+            self.retries += retries
+            self.throttled += throttled
+
+    def _backoff_delay(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        print(f"{self.name}: retrying in {delay:.1f}s after error: {error}")
+        return delay
+
+    def _backoff(self, attempt, error):
+        time.sleep(self._backoff_delay(attempt, error))
+
+    def call(self, fn, *args, cost=1, operation=None, idempotent=True, **kwargs):
+        """
+        Call fn(*args, **kwargs), retrying throttled and transient failures
+
+        Args:
+            fn (callable): The API call, e.g. request.execute
+            cost (int): Tokens the call uses, e.g. the number of requests in a batch
+            operation (str, optional): Name each attempt is recorded under in
+                metrics.metrics, e.g. 'firestore.document.get'
+            idempotent (bool): Whether repeating the call is harmless; if not,
+                transient failures are raised instead of retried
+
+        Returns:
+            The return value of fn
+        """
+        operation = operation or f"{self.name.lower()}.call"
+        attempt = 0
+        while True:
+            self.bucket.acquire(cost)
+            self.concurrency.acquire()
+            kind = None
+            failed = True
+            started = time.perf_counter()
+            try:
+                self._count(calls=1)
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == THROTTLED:
+                    self._count(throttled=1)
+                if kind is None or attempt >= self.max_retries:
+                    raise
+                if kind == TRANSIENT and not idempotent:
+                    raise
+                error = e
+            finally:
+                metrics.record(operation, time.perf_counter() - started, error=failed)
+                self.concurrency.release(throttled=kind == THROTTLED)
+            self._count(retries=1)
+            metrics.add_retry(operation)
+            self._backoff(attempt, error)
+            attempt += 1
+
+    def stream(self, open_stream, operation=None):
+        """
+        Yield the items of a stream, e.g. a Firestore query's stream method
+
+        The request is only sent when the first item is read, so opening the stream
+        and reading its first item run through call() and are rate limited and
+        retried. An error later in the stream is raised, not retried, as the items
+        already yielded would be repeated.
+
+        Args:
+            open_stream (callable): Returns the iterator, e.g. query.stream
+            operation (str, optional): Name the stream is recorded under in metrics
+
+        Yields:
+            The stream's items
+        """
+        operation = operation or f"{self.name.lower()}.stream"
+        end = object()
+
+        def open_first():
+            iterator = iter(open_stream())
+            return iterator, next(iterator, end)
+
+        iterator, item = self.call(open_first, operation=operation)
+        count = 0
+        try:
+            while item is not end:
+                count += 1
+                yield item
+                item = next(iterator, end)
+        finally:
+            metrics.add_items(operation, count)
+
+    async def acall(self, fn, *args, cost=1, operation=None, idempotent=True, **kwargs):
+        """
+        Async counterpart of call for coroutine functions, e.g. aiohttp requests
+
+        Calls share the token bucket and the retry rules of call(), and throttling
+        lowers the same concurrency limit. The number of calls in flight is left to
+        the caller, e.g. the aiohttp connection limit, as waiting for a slot would
+        block the event loop.
+
+        Returns:
+            The result of awaiting fn(*args, **kwargs)
+        """
+        operation = operation or f"{self.name.lower()}.call"
+        attempt = 0
+        while True:
+            await self.bucket.acquire_async(cost)
+            failed = True
+            started = time.perf_counter()
+            try:
+                self._count(calls=1)
+                result = await fn(*args, **kwargs)
+                failed = False
+                return result
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == THROTTLED:
+                    self._count(throttled=1)
+                    self.concurrency.throttled()
+                if kind is None or attempt >= self.max_retries:
+                    raise
+                if kind == TRANSIENT and not idempotent:
+                    raise
+                error = e
+            finally:
+                metrics.record(operation, time.perf_counter() - started, error=failed)
+            self._count(retries=1)
+            metrics.add_retry(operation)
+            await asyncio.sleep(self._backoff_delay(attempt, error))
+            attempt += 1
+
+    async def astream(self, open_stream, operation=None):
+        """Async counterpart of stream for async iterators, e.g. an async Firestore query stream."""
+        operation = operation or f"{self.name.lower()}.stream"
+        end = object()
+
+        async def open_first():
+            iterator = open_stream().__aiter__()
+            try:
+                return iterator, await iterator.__anext__()
+            except StopAsyncIteration:
+                return iterator, end
+
+        iterator, item = await self.acall(open_first, operation=operation)
+        count = 0
+        try:
+            while item is not end:
+                count += 1
+                yield item
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    item = end
+        finally:
+            metrics.add_items(operation, count)
+
+    def execute_batch(self, new_batch, requests):
+        """
+        Execute Drive requests as one batch request, retrying the ones that fail
+
+        Sub-requests that are throttled or fail transiently are sent again in a
+        smaller batch after a backoff; the others are reported as they are.
+
+        Args:
+            new_batch (callable): Returns an empty batch taking a callback, e.g.
+                service.new_batch_http_request
+            requests (list): (request_id, request) pairs, at most 100
+
+        Returns:
+            dict: Maps each request_id to a (response, exception) tuple
+        """
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        pending = list(requests)
+        attempt = 0
+        while pending:
+            batch = new_batch(callback=callback)
+            for request_id, request in pending:
+                batch.add(request, request_id=request_id)
+            self.call(batch.execute, cost=len(pending), operation=f"{self.name.lower()}.batch",
+                      idempotent=all(request_is_idempotent(request) for _, request in pending))
+
+            errors = [(request_id, request, results.get(request_id, (None, None))[1]) for request_id, request in pending]
+            if metrics.enabled:
+                # Batched requests share the batch's latency, so only their outcome is recorded
+                for _, request, error in errors:
+                    metrics.record(request_operation(request), error=error is not None)
+            kinds = [classify_error(error) for _, _, error in errors]
+            retry = [(request_id, request) for (request_id, request, _), kind in zip(errors, kinds)
+                     if kind == THROTTLED or (kind == TRANSIENT and request_is_idempotent(request))]
+            if THROTTLED in kinds:
+                self._count(throttled=kinds.count(THROTTLED))
+                self.concurrency.throttled()
+            if not retry or attempt >= self.max_retries:
+                break
+            self._count(retries=len(retry))
+            if metrics.enabled:
+                for _, request in retry:
+                    metrics.add_retry(request_operation(request))
+            self._backoff(attempt, f"{len(retry)} of {len(pending)} batched requests failed")
+            attempt += 1
+            pending = retry
+        return results
+
+# Shared schedulers for all Drive and Firestore calls. Size the rates to the
+# project's quota; the defaults stay below Drive's per-user limit and Firestore's
+# recommended ramp-up rate for new collections.
+drive_scheduler = RequestScheduler(
+    'Drive',
+    rate=float(os.getenv("DRIVE_REQUESTS_PER_SECOND", "20")),
+    max_concurrency=int(os.getenv("DRIVE_MAX_CONCURRENCY", "16")),
+)
+firestore_scheduler = RequestScheduler(
+    'Firestore',
+    rate=float(os.getenv("FIRESTORE_REQUESTS_PER_SECOND", "500")),
+    max_concurrency=int(os.getenv("FIRESTORE_MAX_CONCURRENCY", "32")),
+)
+
+def request_operation(request):
+    """
+    Return the metrics operation name of a googleapiclient HttpRequest
+
+    Media downloads share their method ID with metadata reads, so they get the
+    method name of the call that created them, e.g. 'drive.files.get_media'.
+    """
+    operation = getattr(request, 'methodId', None) or 'drive.request'
+    if 'alt=media' in (getattr(request, 'uri', None) or ''):
+        operation += '_media'
+    return operation
+
+def request_is_idempotent(request):
+    """Return whether a googleapiclient HttpRequest can be sent again after a transient failure."""
+    return request.method in IDEMPOTENT_METHODS or request_operation(request) in IDEMPOTENT_OPERATIONS
+
+_scheduled_request_class = None
+
+def scheduled_request_class():
+    """
+    Return an HttpRequest subclass whose execute() runs through drive_scheduler
+
+    Pass it as requestBuilder to googleapiclient.discovery.build so every request
+    made through the service is rate limited and retried.
+    """
+    global _scheduled_request_class
+    if _scheduled_request_class is None:
+        from googleapiclient.http import HttpRequest
+
+        class ScheduledHttpRequest(HttpRequest):
+            def execute(self, http=None, num_retries=0):
+                operation = request_operation(self)
+                # A create that timed out may still have made the file, so it is
+                # only retried when throttled
+                result = drive_scheduler.call(
+                    super().execute, http=http, num_retries=num_retries, operation=operation,
+                    idempotent=request_is_idempotent(self))
+                if metrics.enabled:
+                    body = self.body or b''
+                    metrics.add_bytes(
+                        operation, sent=len(body),
+                        received=len(result) if isinstance(result, (bytes, str)) else 0)
+                return result
+
+        _scheduled_request_class = ScheduledHttpRequest
+    return _scheduled_request_class
@@ -7,10 +7,15 @@ setup(
     install_requires=[
         "firebase-admin",
         "termcolor",
-        "google-api-python-client",
+        "google-api-python-client>=2.0",
         "google-auth-httplib2",
+        "httplib2",
         "google-auth-oauthlib",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "preprocess": ["Pillow"],
+    },
     author="Tong",
     author_email="your.email@example.com",
     description="Database utilities for Cows Detector project",
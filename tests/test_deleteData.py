@@ -0,0 +1,121 @@
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+
+import deleteData
+
+
+class FakeSnapshot:
+    def __init__(self, data, fields, store):
+        self.id = str(data['id'])
+        self._data = {key: value for key, value in data.items() if fields is None or key in fields}
+        self.reference = (store, self.id)
+
+    def to_dict(self):
+        return dict(self._data)
+
+    def get(self, field):
+        return self._data[field]
+
+
+class FakeQuery:
+    """Enough of a Firestore query for bulk_delete_project, including its cursor check."""
+
+    def __init__(self, store, filters=(), order=None, fields=None, limit=None, after=None):
+        self.store = store
+        self.filters = filters
+        self.order = order
+        self.fields = fields
+        self._limit = limit
+        self.after = after
+
+    def _copy(self, **changes):
+        values = dict(filters=self.filters, order=self.order, fields=self.fields, limit=self._limit, after=self.after)
+        values.update(changes)
+        return FakeQuery(self.store, **values)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self.filters + ((field, value),))
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        data = snapshot.to_dict()
+        if self.order not in data:
+            # What google-cloud-firestore raises for a snapshot missing the order field
+            raise ValueError(f'The "order by" field path {self.order!r} is not present in the cursor data')
+        return self._copy(after=data[self.order])
+
+    def stream(self):
+        docs = sorted((doc for doc in self.store.values() if all(doc.get(f) == v for f, v in self.filters)),
+                      key=lambda doc: doc[self.order])
+        if self.after is not None:
+            docs = [doc for doc in docs if doc[self.order] > self.after]
+        for doc in docs[:self._limit]:
+            yield FakeSnapshot(doc, self.fields, self.store)
+
+
+class FakeBatch:
+    def __init__(self):
+        self.refs = []
+
+    def delete(self, reference):
+        self.refs.append(reference)
+
+    def commit(self):
+        for store, doc_id in self.refs:
+            del store[doc_id]
+
+
+class FakeDb:
+    def __init__(self, store):
+        self.store = store
+
+    def collection(self, name):
+        return FakeQuery(self.store)
+
+    def batch(self):
+        return FakeBatch()
+
+
+def test_bulk_delete_project_pages_through_every_document():
+    store = {
+        str(image_id): {'id': image_id, 'project': 'cows', 'drive_file_id': f"file{image_id}"}
+        for image_id in range(1, 8)
+    }
+    store['100'] = {'id': 100, 'project': 'other', 'drive_file_id': 'file100'}
+    deleted_files = []
+
+    def delete_drive_files(file_ids):
+        deleted_files.extend(file_ids)
+        return {}
+
+    with mock.patch.object(deleteData, 'get_firestore_client', return_value=FakeDb(store)), \
+         mock.patch.object(deleteData, 'delete_drive_files', side_effect=delete_drive_files):
+        result = deleteData.bulk_delete_project('cows', page_size=3)
+
+    assert result == {'deleted': 7, 'drive_failed': [], 'firestore_failed': []}
+    assert sorted(deleted_files) == sorted(f"file{image_id}" for image_id in range(1, 8))
+    assert list(store) == ['100']
+
+
+def test_bulk_delete_project_keeps_documents_whose_drive_file_failed():
+    store = {str(image_id): {'id': image_id, 'project': 'cows', 'drive_file_id': f"file{image_id}"}
+             for image_id in range(1, 6)}
+
+    with mock.patch.object(deleteData, 'get_firestore_client', return_value=FakeDb(store)), \
+         mock.patch.object(deleteData, 'delete_drive_files', return_value={'file2': 'boom'}):
+        result = deleteData.bulk_delete_project('cows', page_size=2)
+
+    assert result['deleted'] == 4
+    assert result['drive_failed'] == [{'id': '2', 'error': 'boom'}]
+    assert list(store) == ['2']
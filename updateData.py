@@ -1,79 +1,10 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from clients import get_drive_service, get_firestore_client
+from drive_utils import upload_image_to_drive
+from rate_limiter import firestore_scheduler
 import os
 
-# Get credential paths from environment variables
-firebase_cred_path = os.getenv("FIREBASE_CREDENTIALS_JSON")
-drive_cred_path = os.getenv("GOOGLE_DRIVE_CREDENTIALS_JSON")
-
-# Initialize Firebase Admin SDK
-firebase_cred = credentials.Certificate(firebase_cred_path)
-firebase_admin.initialize_app(firebase_cred)
-
-# Initialize Google Drive API
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-drive_cred = service_account.Credentials.from_service_account_file(
-    drive_cred_path, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=drive_cred)
-
-def check_folder_exists(folder_name):
-    """Check if a folder exists in Google Drive and return its ID if found."""
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-    folders = results.get('files', [])
-    
-    if folders:
-        return folders[0]['id']
-    else:
-        return None
-
-def upload_image_to_drive(image_path, destination_name):
-    """Upload an image file to Google Drive and return file ID and sharing URL"""
-    try:
-        # Get the images folder ID
-        images_folder_id = check_folder_exists("images")
-            
-        # Prepare the file metadata
-        file_metadata = {
-            'name': destination_name,
-            'parents': [images_folder_id]  # Use the images folder ID
-        }
-        
-        # Prepare the media file
-        media = MediaFileUpload(
-            image_path,
-            mimetype='image/jpeg' if image_path.lower().endswith('.jpg') else 'image/png',
-            resumable=True
-        )
-        
-        # Upload the file
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
-        
-        # Make the file publicly accessible
-        drive_service.permissions().create(
-            fileId=file['id'],
-            body={'type': 'anyone', 'role': 'reader'},
-            fields='id'
-        ).execute()
-        
-        print(f"Uploaded {image_path} to Google Drive")
-        print(f"File ID: {file['id']}")
-        print(f"Sharing URL: {file['webViewLink']}")
-        
-        return {
-            'file_id': file['id'],
-            'url': file['webViewLink']
-        }
-    except Exception as e:
-        print(f"Error uploading image to Drive: {e}")
-        return None
+# Firestore rejects write batches with more than 500 operations
+FIRESTORE_BATCH_SIZE = 500
 
 def update_image(image_id, update_data):
     """
@@ -92,11 +23,11 @@ def update_image(image_id, update_data):
         bool: True if update was successful, False otherwise
     """
     try:
-        db = firestore.client()
+        db = get_firestore_client()
         
         # Get the current document
         doc_ref = db.collection('images').document(str(image_id))
-        doc = doc_ref.get()
+        doc = firestore_scheduler.call(doc_ref.get, operation='firestore.document.get')
         
         if not doc.exists:
             print(f"Image with ID {image_id} not found")
@@ -120,7 +51,7 @@ def update_image(image_id, update_data):
             # Delete old file from Drive
             if current_file_id:
                 try:
-                    drive_service.files().delete(fileId=current_file_id).execute()
+                    get_drive_service().files().delete(fileId=current_file_id).execute()
                     print(f"Deleted old file from Drive: {current_file_id}")
                 except Exception as e:
                     print(f"Warning: Could not delete old file from Drive: {e}")
@@ -131,14 +62,15 @@ def update_image(image_id, update_data):
             update_data['original_name'] = os.path.basename(update_data['image'])
         
         # Add updated_at timestamp
+        from firebase_admin import firestore
         update_data['updated_at'] = firestore.SERVER_TIMESTAMP
         
         # Update the document
-        doc_ref.update(update_data)
+        firestore_scheduler.call(doc_ref.update, update_data, operation='firestore.document.update')
         print(f"Successfully updated image document with ID: {image_id}")
         
         # Verify the update
-        updated_doc = doc_ref.get()
+        updated_doc = firestore_scheduler.call(doc_ref.get, operation='firestore.document.get')
         if updated_doc.exists:
             print(f"Verified update with data: {updated_doc.to_dict()}")
             return True
@@ -150,22 +82,150 @@ def update_image(image_id, update_data):
         print(f"Error updating image document: {e}")
         return False
 
-def update_project(project_name, update_data):
+_MISSING = object()
+
+def _field_value(data, field_path):
+    """Return the value at a dotted field path such as 'labels.cow', or _MISSING."""
+    for key in field_path.split('.'):
+        if not isinstance(data, dict) or key not in data:
+            return _MISSING
+        data = data[key]
+    return data
+
+def _changed_fields(current_data, update_data):
+    """Return the fields of update_data whose value differs from current_data."""
+    return {
+        field: value for field, value in update_data.items()
+        if _field_value(current_data, field) != value
+    }
+
+def _reread_and_update(db, doc, update_data, result):
+    """
+    Handle a document modified since it was streamed
+
+    The document is read again: if it already holds the target values it counts as
+    skipped, otherwise it is updated against the version just read.
+    """
+    from firebase_admin import firestore
+    from google.api_core.exceptions import FailedPrecondition
+    try:
+        current = firestore_scheduler.call(
+            doc.reference.get, field_paths=list(update_data), operation='firestore.document.get')
+        if not current.exists:
+            raise ValueError("document no longer exists")
+        changes = _changed_fields(current.to_dict(), update_data)
+        if not changes:
+            result['skipped'] += 1
+            return
+        changes['updated_at'] = firestore.SERVER_TIMESTAMP
+        firestore_scheduler.call(
+            doc.reference.update, changes, option=db.write_option(last_update_time=current.update_time),
+            operation='firestore.document.update')
+        result['changed'] += 1
+    except FailedPrecondition:
+        print(f"Failed to update image {doc.id}: it keeps being modified concurrently")
+        result['failed'].append(doc.id)
+    except Exception as e:
+        print(f"Failed to update image {doc.id}: {e}")
+        result['failed'].append(doc.id)
+
+def _commit_updates(db, pending, result, update_data):
+    """Commit (doc, changes) pairs in one batch, retrying one by one if the batch fails."""
+    batch = db.batch()
+    for doc, changes in pending:
+        batch.update(doc.reference, changes, option=db.write_option(last_update_time=doc.update_time))
+    try:
+        firestore_scheduler.call(batch.commit, cost=len(pending), operation='firestore.batch.commit')
+        result['changed'] += len(pending)
+        return
+    except Exception as e:
+        # A batch is atomic, so one stale document fails all of them; isolate it
+        print(f"Batch update failed ({e}), retrying {len(pending)} documents individually")
+
+    from google.api_core.exceptions import FailedPrecondition
+    for doc, changes in pending:
+        try:
+            firestore_scheduler.call(
+                doc.reference.update, changes, option=db.write_option(last_update_time=doc.update_time),
+                operation='firestore.document.update')
+            result['changed'] += 1
+        except FailedPrecondition:
+            # Modified since it was streamed, possibly to the target values already
+            _reread_and_update(db, doc, update_data, result)
+        except Exception as e:
+            print(f"Failed to update image {doc.id}: {e}")
+            result['failed'].append(doc.id)
+
+def bulk_update_project(project_name, update_data, batch_size=FIRESTORE_BATCH_SIZE):
+    """
+    Update all images from a project in batched writes, skipping unchanged documents
+    
+    Only the fields being updated are fetched. Documents that already hold the
+    target values are skipped without a write, and the rest are updated in batches
+    with an update_time precondition instead of being read back. A document
+    modified since it was streamed is read again and compared: it is skipped if it
+    already holds the target values, otherwise updated against its new version.
+    Dotted field paths such as 'labels.cow' are compared against the nested value.
+    
+    Args:
+        project_name (str): Name of the project to update
+        update_data (dict): Fields to update; replacing the image file is not supported
+        batch_size (int): Documents per commit, at most 500
+        
+    Returns:
+        dict: 'changed' and 'skipped' counts and a 'failed' list of image IDs
+    """
+    if 'image' in update_data:
+        raise ValueError("bulk_update_project cannot replace image files; use update_image")
+
+    from firebase_admin import firestore
+    db = get_firestore_client()
+    batch_size = min(batch_size, FIRESTORE_BATCH_SIZE)
+    result = {'changed': 0, 'skipped': 0, 'failed': []}
+
+    docs = firestore_scheduler.stream(db.collection('images')
+                                      .where('project', '==', project_name)
+                                      .select(list(update_data.keys()))
+                                      .stream, operation='firestore.query.stream')
+
+    pending = []
+    for doc in docs:
+        changes = _changed_fields(doc.to_dict(), update_data)
+        if not changes:
+            result['skipped'] += 1
+            continue
+        changes['updated_at'] = firestore.SERVER_TIMESTAMP
+        pending.append((doc, changes))
+        if len(pending) >= batch_size:
+            _commit_updates(db, pending, result, update_data)
+            pending = []
+    if pending:
+        _commit_updates(db, pending, result, update_data)
+
+    print(f"Updated project {project_name}: {result['changed']} changed, "
+          f"{result['skipped']} unchanged, {len(result['failed'])} failed")
+    return result
+
+def update_project(project_name, update_data, bulk=False):
     """
     Update all images from a specific project
     
     Args:
         project_name (str): Name of the project to update
         update_data (dict): Dictionary containing fields to update
+        bulk (bool): Use bulk_update_project instead of updating images one by one
         
     Returns:
         bool: True if update was successful, False otherwise
     """
     try:
-        db = firestore.client()
+        if bulk:
+            return not bulk_update_project(project_name, update_data)['failed']
+
+        db = get_firestore_client()
         
         # Query all documents for the project
-        docs = db.collection('images').where('project', '==', project_name).stream()
+        docs = firestore_scheduler.stream(db.collection('images').where('project', '==', project_name).stream, operation='firestore.query.stream')
         
         success = True
         for doc in docs:
@@ -195,5 +255,8 @@ if __name__ == "__main__":
         # }
         # update_project("Claving", project_update_data)
         
+        # Rename a large project with batched writes
+        # result = bulk_update_project("Claving", project_update_data)
+        
     except Exception as e:
         print(f"Error during update: {e}") 
\ No newline at end of file
@@ -1,13 +1,27 @@
 import os
 import json
-from firebase_admin import firestore
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from termcolor import colored, cprint
-from drive_utils import upload_image_to_drive
+from drive_utils import (
+    upload_image_to_drive, check_folder_exists, create_drive_file, share_file_publicly, upload_journal,
+    ensure_folder_shared, PermissionBatcher, SHARING_PER_FILE, SHARING_INHERIT, SHARING_BATCH
+)
+from content_hash import ContentHashIndex, find_duplicates
+from rate_limiter import firestore_scheduler
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Firestore rejects write batches with more than 500 operations
+MAX_BATCH_SIZE = 500
 
 def get_next_image_id(db):
     try:
         # Query the last document ordered by ID
-        docs = db.collection('images').order_by('id', direction=firestore.Query.DESCENDING).limit(1).stream()
+        from firebase_admin import firestore
+        query = db.collection('images').order_by('id', direction=firestore.Query.DESCENDING).limit(1)
+        docs = firestore_scheduler.stream(query.stream, operation='firestore.query.stream')
         # Get the highest ID and add 1
         for doc in docs:
             return doc.get('id') + 1
@@ -17,11 +31,12 @@ def get_next_image_id(db):
         print(f"Error getting next image ID: {e}")
         return None
 
-def insert_image(db, image_data, image_id, image_name, project_name, labels=None):
+def build_image_document(image_data, image_id, image_name, project_name, labels=None, extra_fields=None):
+    """Build the Firestore document for a newly uploaded image, e.g. with a content_hash in extra_fields."""
     # Get current timestamp
+    from firebase_admin import firestore
     current_time = firestore.SERVER_TIMESTAMP
     
-    # Create document data
     doc_data = {
         "image": image_data['url'],
         "drive_file_id": image_data['file_id'],
@@ -32,26 +47,324 @@ def insert_image(db, image_data, image_id, image_name, project_name, labels=None
         "created_at": current_time,
         "updated_at": current_time
     }
+    if image_data.get('thumbnail_file_id'):
+        doc_data["thumbnail_drive_file_id"] = image_data['thumbnail_file_id']
+    if extra_fields:
+        doc_data.update(extra_fields)
+    return doc_data
+
+def insert_image(db, image_data, image_id, image_name, project_name, labels=None, verify=False, extra_fields=None):
+    # Create document data
+    doc_data = build_image_document(image_data, image_id, image_name, project_name, labels, extra_fields)
     
     try:
         print(f"Attempting to insert document with ID: {image_id}")
-        print(f"Document data: {doc_data}")
         # Add document to 'images' collection with image_id as document ID
-        db.collection('images').document(str(image_id)).set(doc_data)
+        firestore_scheduler.call(
+            db.collection('images').document(str(image_id)).set, doc_data, operation='firestore.document.set')
         print(f"Successfully inserted image document with ID: {image_id}")
         
-        # Verify the document was inserted
-        doc_ref = db.collection('images').document(str(image_id)).get()
-        if doc_ref.exists:
-            print(f"Verified document exists with data: {doc_ref.to_dict()}")
-        else:
-            print("Warning: Document was not found after insertion!")
+        # Optionally verify the document was inserted (costs an extra read)
+        if verify:
+            doc_ref = firestore_scheduler.call(
+                db.collection('images').document(str(image_id)).get, operation='firestore.document.get')
+            if doc_ref.exists:
+                print(f"Verified document exists with ID: {image_id}")
+            else:
+                print("Warning: Document was not found after insertion!")
         return True
     except Exception as e:
         print(f"Error inserting image document: {e}")
         return False
 
-def process_images_from_uploadgate(db, project_name, upload_gate_dir="./uploadGate"):
+class ImageBatchWriter:
+    """
+    Accumulate image documents and commit them in Firestore write batches
+
+    Documents are committed every batch_size additions and on flush(); using the
+    writer as a context manager flushes on exit. Instead of reading every document
+    back, a random sample of each committed batch can be verified with a single
+    get_all call.
+
+    Args:
+        db: Firestore database instance
+        batch_size (int): Documents per commit, at most 500
+        verify_sample_rate (float): Fraction of documents read back after commit
+    """
+
+    def __init__(self, db, batch_size=MAX_BATCH_SIZE, verify_sample_rate=0.0):
+        self.db = db
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.verify_sample_rate = verify_sample_rate
+        self.written = []
+        self.failed = []
+        self._pending = []  # (image_id, doc_data) tuples
+        self._lock = threading.Lock()
+
+    def add(self, image_data, image_id, image_name, project_name, labels=None, extra_fields=None):
+        """Queue an image document, committing the batch once it is full."""
+        doc_data = build_image_document(image_data, image_id, image_name, project_name, labels, extra_fields)
+        with self._lock:
+            self._pending.append((image_id, doc_data))
+            if len(self._pending) >= self.batch_size:
+                self._commit()
+
+    def flush(self):
+        """
+        Commit any queued documents
+
+        Returns:
+            bool: True if no batch has failed so far, False otherwise
+        """
+        with self._lock:
+            if self._pending:
+                self._commit()
+            return not self.failed
+
+    def _commit(self):
+        # Caller must hold self._lock
+        pending, self._pending = self._pending, []
+        image_ids = [image_id for image_id, _ in pending]
+        try:
+            batch = self.db.batch()
+            for image_id, doc_data in pending:
+                batch.set(self.db.collection('images').document(str(image_id)), doc_data)
+            firestore_scheduler.call(batch.commit, cost=len(pending), operation='firestore.batch.commit')
+            self.written.extend(image_ids)
+            print(f"Committed {len(pending)} image documents (IDs {image_ids[0]}-{image_ids[-1]})")
+        except Exception as e:
+            self.failed.extend(image_ids)
+            print(f"Error committing batch of {len(pending)} image documents: {e}")
+            return
+        self._verify_sample(image_ids)
+
+    def _verify_sample(self, image_ids):
+        # Runs after a successful commit, so a failed read is logged, never counted as a failed write
+        sample = [image_id for image_id in image_ids if random.random() < self.verify_sample_rate]
+        if not sample:
+            return
+
+        def get_all(refs):
+            return list(self.db.get_all(refs, field_paths=['id']))
+
+        try:
+            refs = [self.db.collection('images').document(str(image_id)) for image_id in sample]
+            snapshots = firestore_scheduler.call(
+                get_all, refs, cost=len(refs), operation='firestore.document.get_all')
+        except Exception as e:
+            print(f"Warning: Could not verify {len(sample)} sampled documents: {e}")
+            return
+        missing = [snapshot.id for snapshot in snapshots if not snapshot.exists]
+        if missing:
+            print(f"Warning: Documents not found after batch commit: {missing}")
+        else:
+            print(f"Verified {len(sample)} sampled documents")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+def _resumed_image_ids(db, images_dir, image_files, folder_id):
+    """
+    Return the image IDs of files whose upload was interrupted, from the upload journal
+
+    An ID that another image's document has taken since is not handed back; the
+    file's journal entry is dropped and its upload starts over under a new ID.
+    """
+    resumed = {}
+    for image_file in image_files:
+        entry = upload_journal.lookup(os.path.join(images_dir, image_file), folder_id)
+        if entry is not None and entry.get('image_id') is not None:
+            resumed[image_file] = entry['image_id']
+    if not resumed:
+        return resumed
+
+    def get_all(refs):
+        return list(db.get_all(refs, field_paths=['id']))
+
+    refs = [db.collection('images').document(str(image_id)) for image_id in resumed.values()]
+    snapshots = firestore_scheduler.call(get_all, refs, cost=len(refs), operation='firestore.document.get_all')
+    taken = {snapshot.id for snapshot in snapshots if snapshot.exists}
+    for image_file, image_id in list(resumed.items()):
+        if str(image_id) in taken:
+            print(f"Image ID {image_id} of the interrupted upload of {image_file} is taken, starting it over")
+            upload_journal.remove(upload_journal.key(os.path.join(images_dir, image_file), folder_id))
+            del resumed[image_file]
+    return resumed
+
+def _assign_image_ids(image_files, start_id, resumed):
+    """
+    Assign an image ID to each file in order, starting at start_id
+
+    Files in resumed keep the ID their interrupted upload was started under, and
+    the other files skip those IDs.
+
+    Returns:
+        list: (image_id, image_file) pairs
+    """
+    reserved = set(resumed.values())
+    assigned = []
+    next_id = start_id
+    for image_file in image_files:
+        if image_file in resumed:
+            assigned.append((resumed[image_file], image_file))
+            continue
+        while next_id in reserved:
+            next_id += 1
+        assigned.append((next_id, image_file))
+        next_id += 1
+    return assigned
+
+def _process_images_pipelined(db, project_name, images_dir, image_files, annotations, start_id,
+                              max_workers, batch_size=MAX_BATCH_SIZE, verify_sample_rate=0.0,
+                              sharing=SHARING_PER_FILE, extra_fields=None, thumbnails=None):
+    """
+    Upload images through separate Drive upload, permission and Firestore stages
+
+    Each stage has its own thread pool and hands finished work to the next one, so
+    uploads, permission grants and inserts for different images overlap. Documents
+    are inserted through an ImageBatchWriter. IDs are assigned up front from the
+    sorted file list, so a failed image leaves a gap instead of shifting the IDs of
+    the images after it; files whose upload was interrupted keep their earlier ID. With SHARING_INHERIT the permission stage is skipped, and
+    with SHARING_BATCH its grants are sent through a PermissionBatcher.
+    extra_fields maps file names to additional document fields, and thumbnails maps
+    file names to thumbnail paths uploaded and shared alongside the images.
+
+    Returns:
+        tuple: (list of (image_id, image_file) inserted, list of (image_id, image_file) that failed)
+    """
+    images_folder_id = check_folder_exists("images")
+    if images_folder_id is None:
+        raise Exception("Images folder not found in Google Drive")
+    if sharing == SHARING_INHERIT:
+        ensure_folder_shared(images_folder_id)
+
+    failed = []
+    lock = threading.Lock()
+
+    def fail(image_id, image_file, stage, error):
+        print(f"Failed to {stage} image {image_file} with ID {image_id}: {error}")
+        with lock:
+            failed.append((image_id, image_file))
+
+    writer = ImageBatchWriter(db, batch_size=batch_size, verify_sample_rate=verify_sample_rate)
+    permission_batcher = PermissionBatcher()
+    upload_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+    permission_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="permission")
+    # The batch writer serialises commits, so one insert thread is enough
+    insert_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="insert")
+
+    def insert_stage(image_id, image_file, file):
+        try:
+            labels = annotations.get(str(image_id), {}).get('label', [])
+            image_data = {'file_id': file['id'], 'url': file['webViewLink'],
+                          'thumbnail_file_id': file.get('thumbnail_id')}
+            writer.add(image_data, image_id, image_file, project_name, labels,
+                       (extra_fields or {}).get(image_file))
+        except Exception as e:
+            fail(image_id, image_file, "insert", e)
+
+    def permission_stage(image_id, image_file, file):
+        file_ids = [file['id']] + ([file['thumbnail_id']] if file.get('thumbnail_id') else [])
+        if sharing == SHARING_BATCH:
+            # The document is inserted once the image and its thumbnail are both shared
+            outcome = {'remaining': len(file_ids), 'error': None}
+            def on_shared(error):
+                with lock:
+                    outcome['error'] = outcome['error'] or error
+                    outcome['remaining'] -= 1
+                    if outcome['remaining']:
+                        return
+                if outcome['error'] is None:
+                    insert_pool.submit(insert_stage, image_id, image_file, file)
+                else:
+                    fail(image_id, image_file, "share", outcome['error'])
+            for file_id in file_ids:
+                permission_batcher.add(file_id, on_shared)
+            return
+        try:
+            for file_id in file_ids:
+                share_file_publicly(file_id)
+            insert_pool.submit(insert_stage, image_id, image_file, file)
+        except Exception as e:
+            fail(image_id, image_file, "share", e)
+
+    def upload_stage(image_id, image_file):
+        try:
+            image_path = os.path.join(images_dir, image_file)
+            file = create_drive_file(image_path, f"{image_id}_{image_file}", images_folder_id, image_id=image_id)
+            thumbnail_path = (thumbnails or {}).get(image_file)
+            if thumbnail_path:
+                # The original is already on Drive, so a failed thumbnail must not orphan it
+                try:
+                    thumbnail = create_drive_file(
+                        thumbnail_path, f"{image_id}_{os.path.basename(thumbnail_path)}", images_folder_id,
+                        image_id=image_id)
+                    file['thumbnail_id'] = thumbnail['id']
+                except Exception as e:
+                    print(f"Warning: Could not upload the thumbnail of {image_file}, continuing without it: {e}")
+            if sharing == SHARING_INHERIT:
+                insert_pool.submit(insert_stage, image_id, image_file, file)
+            else:
+                permission_pool.submit(permission_stage, image_id, image_file, file)
+        except Exception as e:
+            fail(image_id, image_file, "upload", e)
+
+    assigned = _assign_image_ids(image_files, start_id, _resumed_image_ids(db, images_dir, image_files, images_folder_id))
+    for image_id, image_file in assigned:
+        upload_pool.submit(upload_stage, image_id, image_file)
+
+    # Each stage only submits to the next one, so shutting the pools down in order drains the pipeline
+    upload_pool.shutdown(wait=True)
+    permission_pool.shutdown(wait=True)
+    permission_batcher.flush()
+    insert_pool.shutdown(wait=True)
+    writer.flush()
+
+    files_by_id = dict(assigned)
+    failed.extend((image_id, files_by_id[image_id]) for image_id in writer.failed)
+    inserted = [(image_id, files_by_id[image_id]) for image_id in writer.written]
+    return inserted, sorted(failed)
+
+def process_images_from_uploadgate(db, project_name, upload_gate_dir="./uploadGate", max_workers=1,
+                                   batch_size=MAX_BATCH_SIZE, verify_sample_rate=0.0,
+                                   sharing=SHARING_PER_FILE, dedup=False, preprocess=False,
+                                   max_side=2048, quality=85, thumbnails=False, thumbnail_size=256):
+    """
+    Upload every image in the uploadGate images directory and insert its document
+
+    Args:
+        db: Firestore database instance
+        project_name (str): Name of the project
+        upload_gate_dir (str): Path to uploadGate directory
+        max_workers (int): Images kept in flight per stage; values above 1 enable
+            the pipelined uploader, which assigns IDs in sorted filename order
+        batch_size (int): Documents per Firestore commit in the pipelined uploader
+        verify_sample_rate (float): Fraction of inserted documents read back to
+            verify them in the pipelined uploader
+        sharing (str): SHARING_PER_FILE, SHARING_INHERIT (files inherit public access
+            from the shared images folder) or SHARING_BATCH (per-file grants sent in
+            batch requests, pipelined uploader only)
+        dedup (bool): Hash each file before uploading and skip content that is
+            already stored; skipped files and the IDs they match are written to
+            duplicates.json in upload_gate_dir
+        preprocess (bool): Resize, re-encode and strip EXIF from each image in a
+            process pool before uploading (requires Pillow). The processed files
+            are written to preprocessed/ in upload_gate_dir, and their width,
+            height and size_bytes are stored on the documents
+        max_side (int): Largest width or height in pixels when preprocessing
+        quality (int): JPEG quality from 1 to 95 when preprocessing
+        thumbnails (bool): Also upload a JPEG thumbnail of each image (requires
+            Pillow) and store its Drive ID as thumbnail_drive_file_id. Images whose
+            thumbnail cannot be made are uploaded without one
+        thumbnail_size (int): Longest side of a thumbnail in pixels
+
+    Returns:
+        bool: True if processing was successful, False otherwise
+    """
     try:
         # Get next available ID
         current_id = get_next_image_id(db)
@@ -71,37 +384,117 @@ def process_images_from_uploadgate(db, project_name, upload_gate_dir="./uploadGa
         if os.path.exists(annotations_file):
             with open(annotations_file, 'r') as f:
                 annotations = json.load(f)
+
+        image_files = [f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if max_workers > 1:
+            image_files.sort()
+
+        # Skip content that is already stored before any bytes are uploaded
+        extra_fields = {}
+        hash_index = None
+        if dedup:
+            hash_index = ContentHashIndex()
+            hash_index.refresh(db)
+            unique, duplicates = find_duplicates(images_dir, image_files, hash_index, max_workers, db=db)
+            for image_file, existing in duplicates.items():
+                print(f"Skipping {image_file}: same content as {existing}")
+            with open(os.path.join(upload_gate_dir, "duplicates.json"), 'w') as f:
+                json.dump(duplicates, f, indent=2)
+            image_files = [image_file for image_file, _ in unique]
+            extra_fields = {image_file: {'content_hash': content_hash} for image_file, content_hash in unique}
+
+        # Shrink the files that are left before uploading; hashes above are of the originals
+        upload_dir = images_dir
+        if preprocess:
+            from preprocess import preprocess_images
+            upload_dir = os.path.join(upload_gate_dir, "preprocessed")
+            processed, preprocess_failed = preprocess_images(
+                images_dir, image_files, upload_dir, max_side=max_side, quality=quality)
+            for image_file, error in preprocess_failed.items():
+                print(f"Skipping {image_file}: could not preprocess it: {error}")
+            image_files = [image_file for image_file in image_files if image_file in processed]
+            for image_file, fields in processed.items():
+                extra_fields.setdefault(image_file, {}).update(fields)
+
+        # Thumbnails are made from the originals, in a process pool like preprocessing
+        thumbnail_paths = {}
+        if thumbnails:
+            from preprocess import make_thumbnails, thumbnail_name
+            thumbnails_dir = os.path.join(upload_gate_dir, "thumbnails")
+            made, thumbnail_failed = make_thumbnails(images_dir, image_files, thumbnails_dir, size=thumbnail_size)
+            for image_file, error in thumbnail_failed.items():
+                print(f"Uploading {image_file} without a thumbnail: {error}")
+            thumbnail_paths = {
+                image_file: os.path.join(thumbnails_dir, thumbnail_name(image_file)) for image_file in made
+            }
+
+        if max_workers > 1:
+            inserted, failed = _process_images_pipelined(
+                db, project_name, upload_dir, image_files, annotations, current_id, max_workers,
+                batch_size=batch_size, verify_sample_rate=verify_sample_rate, sharing=sharing,
+                extra_fields=extra_fields, thumbnails=thumbnail_paths)
+            print(f"Processed {len(inserted)} of {len(image_files)} images ({len(failed)} failed)")
+            if hash_index is not None:
+                for image_id, image_file in inserted:
+                    hash_index.add(extra_fields[image_file]['content_hash'], image_id)
+                hash_index.save()
+            return True
         
+        # Files whose upload was interrupted keep their ID; the others skip those IDs
+        images_folder_id = check_folder_exists("images")
+        resumed = _resumed_image_ids(db, upload_dir, image_files, images_folder_id)
+        reserved = set(resumed.values())
+
         # Process each image file
-        for image_file in os.listdir(images_dir):
-            if image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                image_path = os.path.join(images_dir, image_file)
-                
-                # Upload image to Google Drive
-                destination_name = f"{current_id}_{image_file}"
-                image_data = upload_image_to_drive(image_path, destination_name)
-                
-                if image_data:
-                    # Get labels from annotations if they exist
-                    labels = []
-                    if str(current_id) in annotations:
-                        labels = annotations[str(current_id)].get('label', [])
-                    # Insert image document with the Drive data
-                    success = insert_image(
-                        db=db,
-                        image_data=image_data,
-                        image_id=current_id,
-                        image_name=image_file,
-                        project_name=project_name,
-                        labels=labels
-                    )
-                    if success:
-                        print(f"Successfully processed {image_file} with ID: {current_id}")
-                        current_id += 1
-                    else:
-                        print(f"Failed to insert image document: {image_file} with ID: {current_id}")
+        for image_file in image_files:
+            image_path = os.path.join(upload_dir, image_file)
+            resumed_id = resumed.get(image_file)
+            next_id = current_id
+            while next_id in reserved:
+                next_id += 1
+            image_id = resumed_id if resumed_id is not None else next_id
+            
+            # Upload image to Google Drive
+            destination_name = f"{image_id}_{image_file}"
+            image_data = upload_image_to_drive(image_path, destination_name, sharing=sharing, image_id=image_id)
+            thumbnail_path = thumbnail_paths.get(image_file)
+            if image_data and thumbnail_path:
+                thumbnail = upload_image_to_drive(
+                    thumbnail_path, f"{image_id}_{os.path.basename(thumbnail_path)}", sharing=sharing,
+                    image_id=image_id)
+                image_data = image_data if thumbnail is None else dict(image_data, thumbnail_file_id=thumbnail['file_id'])
+            
+            if image_data:
+                # Get labels from annotations if they exist
+                labels = []
+                if str(image_id) in annotations:
+                    labels = annotations[str(image_id)].get('label', [])
+                # Insert image document with the Drive data
+                success = insert_image(
+                    db=db,
+                    image_data=image_data,
+                    image_id=image_id,
+                    image_name=image_file,
+                    project_name=project_name,
+                    labels=labels,
+                    extra_fields=extra_fields.get(image_file)
+                )
+                if success:
+                    print(f"Successfully processed {image_file} with ID: {image_id}")
+                    if hash_index is not None:
+                        hash_index.add(extra_fields[image_file]['content_hash'], image_id)
+                    if resumed_id is None:
+                        current_id = next_id + 1
                 else:
-                    print(f"Failed to upload image to Drive: {image_file} with ID: {current_id}")
+                    print(f"Failed to insert image document: {image_file} with ID: {image_id}")
+            else:
+                print(f"Failed to upload image to Drive: {image_file} with ID: {image_id}")
+                # An upload that failed part way keeps its ID in the journal for the
+                # next run, so no other file may take it
+                if upload_journal.lookup(image_path, images_folder_id) is not None:
+                    reserved.add(image_id)
+        if hash_index is not None:
+            hash_index.save()
         return True
     except Exception as e:
         print(f"Error processing images from uploadGate: {e}")
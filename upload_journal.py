@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+DEFAULT_JOURNAL_PATH = os.getenv("DRIVE_UPLOAD_JOURNAL", "./upload_journal.json")
+
+class UploadJournal:
+    """
+    Local record of unfinished resumable Drive uploads
+
+    Each entry maps a file being uploaded to its resumable session URI, the
+    number of bytes Drive has committed, and the destination name and image ID it
+    was uploaded under, so a restarted process can continue the upload instead of
+    sending the file again. Entries are keyed by the file's path, size and
+    modification time and the destination folder, so they do not depend on the
+    name or ID a new run would give the file. Entries are dropped when the upload
+    completes; entries of files that have changed or gone are dropped when the
+    journal file is read, on first use.
+
+    Args:
+        path (str): JSON file the journal is persisted to
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self._entries = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image_path, folder_id):
+        """Return the journal key of a file uploaded into folder_id."""
+        stat = os.stat(image_path)
+        return f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime}|{folder_id}"
+
+    def _is_current(self, key, entry):
+        try:
+            return self.key(entry['image_path'], entry['folder_id']) == key
+        except (OSError, KeyError):
+            return False
+
+    def _load(self):
+        # Caller must hold self._lock
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read upload journal {self.path}: {e}")
+            return
+        self._entries = {key: entry for key, entry in entries.items() if self._is_current(key, entry)}
+
+    def _save(self):
+        # Caller must hold self._lock
+        try:
+            if not self._entries:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Warning: Could not save upload journal {self.path}: {e}")
+
+    def get(self, key):
+        """
+        Return the journal entry for key, or None if there is none
+
+        Returns:
+            dict: 'session_uri', 'offset', 'destination_name' and 'image_id' (None
+                if the upload was not made for an image document)
+        """
+        with self._lock:
+            self._load()
+            return self._entries.get(key)
+
+    def lookup(self, image_path, folder_id):
+        """Return the entry of an unfinished upload of image_path into folder_id, or None."""
+        try:
+            return self.get(self.key(image_path, folder_id))
+        except OSError:
+            return None
+
+    def record(self, key, image_path, folder_id, session_uri, offset, destination_name, image_id=None):
+        """Persist an upload in progress: its session URI, committed offset, name and image ID."""
+        entry = {
+            'image_path': os.path.abspath(image_path),
+            'folder_id': folder_id,
+            'session_uri': session_uri,
+            'offset': offset,
+            'destination_name': destination_name,
+            'image_id': image_id,
+        }
+        with self._lock:
+            self._load()
+            self._entries[key] = entry
+            self._save()
+
+    def remove(self, key):
+        """Forget an upload once it has completed or its session can no longer be used."""
+        with self._lock:
+            self._load()
+            if self._entries.pop(key, None) is not None:
+                self._save()